@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import random
+import pandas as pd
+
+# the transform scripts import each other by file name, the made up names come from the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "transform"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests"))
+
+from name_generator import random_name
+from cleaner import (
+    clean_track_name, clean_artist_name, clean_track_names, clean_artist_names, clean_distinct,
+)
+
+# run from the project root: python src/benchmark_cleaner.py
+# times the row cleaners against the column cleaners, tests/test_cleaner_parity.py checks they agree
+
+ROWS = 1_000_000
+
+def benchmark(rows=ROWS):
+    """Time the row by row apply against the column cleaners on a synthetic history"""
+    rng = random.Random(0)
+    distinct = [random_name(rng) for _ in range(20_000)]
+    history = pd.Series([rng.choice(distinct) for _ in range(rows)], dtype=object)
+
+    start = time.perf_counter()
+    history.apply(clean_track_name)
+    history.apply(clean_artist_name)
+    apply_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clean_track_names(history)
+    clean_artist_names(history)
+    column_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clean_distinct(history, clean_track_names)
+    clean_distinct(history, clean_artist_names)
+    distinct_seconds = time.perf_counter() - start
+
+    print(f"{rows:,} rows")
+    print(f"  apply:    {apply_seconds:.2f}s ({rows / apply_seconds:,.0f} rows/sec)")
+    print(f"  columns:  {column_seconds:.2f}s ({rows / column_seconds:,.0f} rows/sec)")
+    print(f"  distinct: {distinct_seconds:.2f}s ({rows / distinct_seconds:,.0f} rows/sec)")
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,150 @@
+import io
+import os
+import sys
+import json
+import logging
+import time
+import hashlib
+import tempfile
+import threading
+import contextlib
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# run from the project root: python src/benchmark_enricher.py
+# starts a local stand-in for the Spotify API that answers slowly and throttles with 429s,
+# then runs the enrichment against it with one worker and with a pool of workers,
+# and once more with the pool's cache filled
+
+TRACKS = 1_000
+LATENCY = 0.05  # seconds every request takes
+SERVER_RATE = 100  # requests per second the stand-in allows before answering 429
+RETRY_AFTER = 1
+
+def fake_id(text):
+    """A made up 22 character Spotify ID"""
+    return hashlib.md5(text.encode()).hexdigest()[:22]
+
+def fake_track(track_id):
+    return {
+        'id': track_id,
+        'artists': [{'id': fake_id("artist" + track_id[:2]), 'name': "Artist " + track_id[:2]}],
+        'album': {'name': "Album", 'release_date': "2020-01-01", 'images': []},
+        'popularity': 50,
+        'explicit': False,
+        'duration_ms': 200_000,
+    }
+
+class StandInSpotify(BaseHTTPRequestHandler):
+    """Answers search, tracks, artists and audio-features like the Spotify API would"""
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(LATENCY)
+
+        with server.lock:
+            server.requests += 1
+            now = time.monotonic()
+            server.tokens = min(SERVER_RATE, server.tokens + (now - server.updated) * SERVER_RATE)
+            server.updated = now
+            throttled = server.tokens < 1
+            if throttled:
+                server.throttled += 1
+            else:
+                server.tokens -= 1
+
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', str(RETRY_AFTER))
+            self.end_headers()
+            return
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        endpoint = url.path.rstrip('/').split('/')[-1]
+        ids = params.get('ids', [""])[0].split(',')
+
+        if endpoint == 'search':
+            query = params['q'][0]
+            # a third of the searches find nothing
+            found = int(hashlib.md5(query.encode()).hexdigest(), 16) % 3 != 0
+            body = {'tracks': {'items': [fake_track(fake_id(query))] if found else []}}
+        elif endpoint == 'tracks':
+            body = {'tracks': [fake_track(track_id) for track_id in ids]}
+        elif endpoint == 'artists':
+            body = {'artists': [{'id': artist_id, 'genres': ["pop", "stand-in"]} for artist_id in ids]}
+        elif endpoint == 'audio-features':
+            body = {'audio_features': [
+                {'id': track_id, 'energy': 0.5, 'valence': 0.5, 'danceability': 0.5, 'tempo': 120.0}
+                for track_id in ids
+            ]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInSpotify)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.throttled = 0
+    server.tokens = SERVER_RATE
+    server.updated = time.monotonic()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def unique_tracks(count=TRACKS):
+    """Half the tracks come with a Spotify ID (like spotify listens), the rest need a search"""
+    return pd.DataFrame({
+        'track': [f"song {number}" for number in range(count)],
+        'artist': [f"artist {number % 97}" for number in range(count)],
+        'play_count': 1,
+        'spotify_id': [fake_id(f"known {number}") if number % 2 == 0 else None for number in range(count)],
+    })
+
+if __name__ == "__main__":
+    server = start_server()
+
+    # the enricher makes its client on import, so point it at the stand-in first
+    os.environ['SPOTIFY_API_PREFIX'] = f"http://127.0.0.1:{server.server_port}/v1/"
+    os.environ['SPOTIFY_ACCESS_TOKEN'] = "stand-in"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "enrich"))
+    import spotify_enricher
+
+    # the 429s are expected here, spotipy logging each one would drown the results
+    logging.getLogger("spotipy").setLevel(logging.CRITICAL)
+
+    # never touch the real cache
+    cache_folder = tempfile.mkdtemp()
+
+    # allow more than the stand-in does, so the throttling actually happens
+    spotify_enricher.rate_limiter = spotify_enricher.TokenBucket(rate=SERVER_RATE * 2, burst=SERVER_RATE * 2)
+
+    print(f"{TRACKS:,} tracks, {LATENCY * 1000:.0f}ms per request, stand-in allows {SERVER_RATE} requests/sec")
+    # a cold cache for each pool size, then the 16 worker run again with its cache filled
+    for workers in [1, 16, 16]:
+        cache_path = os.path.join(cache_folder, f"{workers}_workers.sqlite")
+        warm = os.path.exists(cache_path)
+        server.requests = 0
+        server.throttled = 0
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            enriched = spotify_enricher.enrich_tracks_optimized(unique_tracks(), workers=workers, cache_path=cache_path)
+        seconds = time.perf_counter() - start
+
+        print(f"  {workers:2} workers{', warm cache' if warm else ''}: {seconds:.1f}s, {server.requests:,} requests ({server.throttled:,} answered 429), "
+              f"{enriched['spotify_id'].notna().sum():,} found, {enriched['energy'].notna().sum():,} with audio features")
+
+    server.shutdown()
@@ -3,8 +3,8 @@ import os
 
 # Load your raw saved data
 # (Assuming you successfully ran the loaders from Phase 2)
-yt_path = "data/processed/youtube_history_2025.parquet"
-sp_path = "data/processed/spotify_history.parquet"
+yt_path = "data/processed/listens/source=youtube"
+sp_path = "data/processed/listens/source=spotify"
 
 print("--- YOUTUBE SAMPLE (The Messy One) ---")
 if os.path.exists(yt_path):
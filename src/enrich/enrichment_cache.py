@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import sqlite3
+
+CACHE_FOLDER = os.path.join("data", "cache")
+CACHE_PATH = os.path.join(CACHE_FOLDER, "spotify_enrichment.sqlite")
+
+DAY = 24 * 60 * 60
+
+# how long an answer from spotify is trusted before it is asked again
+TRACK_TTL = 90 * DAY
+GENRES_TTL = 30 * DAY  # artists get their genres updated now and then
+AUDIO_FEATURES_TTL = 365 * DAY  # the features of a recording don't change
+
+# searches that found nothing are tried again sooner, the track might have been added since
+MISSING_TTL = 14 * DAY
+
+# table -> (key columns, value column, ttl), a NULL value means spotify didn't have it
+TABLES = {
+    'tracks': (['track', 'artist'], 'metadata', TRACK_TTL),
+    'videos': (['video_id'], 'spotify_id', TRACK_TTL),
+    'genres': (['artist_id'], 'genres', GENRES_TTL),
+    'audio_features': (['spotify_id'], 'features', AUDIO_FEATURES_TTL),
+}
+
+# the most keys one query asks for, sqlite limits the number of parameters
+KEYS_PER_QUERY = 500
+
+# values stored as json text
+JSON_VALUES = {'metadata', 'features'}
+
+class EnrichmentCache:
+    """
+    Answers from spotify kept in SQLite between runs, each kind with its own TTL:
+    (track, artist) -> track metadata, youtube video id -> spotify id,
+    artist id -> genres and spotify id -> audio features.
+    Searches that found nothing are kept as well (as NULL), so they aren't repeated every run
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.now = time.time()
+
+        with self.connection:
+            for table, (key_columns, value_column, _) in TABLES.items():
+                columns = ", ".join(f"{column} TEXT NOT NULL" for column in key_columns)
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ({columns}, {value_column} TEXT, "
+                    f"fetched_at REAL NOT NULL, PRIMARY KEY ({', '.join(key_columns)}))"
+                )
+
+    def rows(self, table, keys=None):
+        key_columns, value_column, ttl = TABLES[table]
+        query = (
+            f"SELECT {', '.join(key_columns)}, {value_column} FROM {table} "
+            f"WHERE fetched_at >= CASE WHEN {value_column} IS NULL THEN ? ELSE ? END"
+        )
+        fresh_since = (self.now - MISSING_TTL, self.now - ttl)
+
+        if keys is None:
+            yield from self.connection.execute(query, fresh_since)
+            return
+
+        keys = list(keys)
+        for start in range(0, len(keys), KEYS_PER_QUERY):
+            some_keys = keys[start:start + KEYS_PER_QUERY]
+            yield from self.connection.execute(
+                f"{query} AND {key_columns[0]} IN ({', '.join('?' * len(some_keys))})",
+                (*fresh_since, *some_keys),
+            )
+
+    def get(self, table, keys=None):
+        """
+        Every entry of a table that hasn't expired, as a dict key -> value (None when spotify didn't have it).
+        Keys of tables with several key columns are tuples.
+        With keys (for tables with one key column) only those entries are read
+        """
+        _, value_column, _ = TABLES[table]
+
+        entries = {}
+        for *key, value in self.rows(table, keys):
+            if value is not None and value_column in JSON_VALUES:
+                value = json.loads(value)
+            entries[tuple(key) if len(key) > 1 else key[0]] = value
+        return entries
+
+    def put(self, table, entries):
+        """
+        Store fresh answers (a dict key -> value, None for nothing found), in one transaction
+        """
+        key_columns, value_column, _ = TABLES[table]
+        rows = []
+        for key, value in entries.items():
+            if value is not None and value_column in JSON_VALUES:
+                value = json.dumps(value)
+            rows.append((*(key if len(key_columns) > 1 else (key,)), value, self.now))
+
+        placeholders = ", ".join("?" * (len(key_columns) + 2))
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(key_columns)}, {value_column}, fetched_at) "
+                f"VALUES ({placeholders})",
+                rows,
+            )
+
+    def prune(self):
+        """Drop the entries that have expired, they would be asked again anyway"""
+        with self.connection:
+            for table, (_, value_column, ttl) in TABLES.items():
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE fetched_at < CASE WHEN {value_column} IS NULL THEN ? ELSE ? END",
+                    (self.now - MISSING_TTL, self.now - ttl),
+                )
+
+    def close(self):
+        self.prune()
+        self.connection.close()
@@ -1,41 +1,235 @@
 import os
+import sys
+import numpy as np
 import pandas as pd
 import time
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import spotipy
+from spotipy.exceptions import SpotifyException
 from spotipy.oauth2 import SpotifyClientCredentials
 from dotenv import load_dotenv
+from enrichment_cache import EnrichmentCache, CACHE_PATH
 
 # Load environment variables
 load_dotenv()
 
 PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
 
+# the most IDs the several-at-once endpoints take per request
+TRACKS_PER_REQUEST = 50
+ARTISTS_PER_REQUEST = 50
+AUDIO_FEATURES_PER_REQUEST = 100
+
+AUDIO_FEATURES = ['energy', 'valence', 'danceability', 'tempo']
+
+# how many requests are in flight at the same time
+ENRICH_WORKERS = 8
+MAX_CONNECTIONS = 32
+
+# how fast we call spotify: a steady rate, with short bursts up to BURST requests
+REQUESTS_PER_SECOND = 20
+BURST = 20
+
+# a failed request is tried again this many times, waiting BACKOFF_SECONDS, then twice that, ...
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1
+
+# artist id -> genres for the artists resolved most recently, kept for as long as the process runs
+ARTIST_MEMO_SIZE = 10_000
+
+# search answers go into the cache every CHECKPOINT_SIZE tracks, so a run that dies
+# starts again from the last checkpoint instead of from scratch
+CHECKPOINT_SIZE = 200
+
+# seconds between progress lines
+PROGRESS_SECONDS = 10
+
+# what search_track_on_spotify returns when the request failed, rather than found nothing
+SEARCH_FAILED = 'search failed'
+
+# kept in the audio features cache (as missing) after a 403, so the endpoint isn't asked
+# again until the entry expires. real spotify ids are 22 letters and digits, so it never clashes
+AUDIO_FEATURES_REFUSED = 'refused (403)'
+
+TRACK_URI_PREFIX = 'spotify:track:'
+# IDs mentioning any of these are local files, podcasts or links, not tracks
+INVALID_ID_MARKERS = 'local|episode|http|unknown'
+
 # --- AUTHENTICATION ---
-def get_spotify_client():
-    """Authenticates with Spotify using Client Credentials Flow"""
-    return spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-        client_id=os.getenv("SPOTIFY_CLIENT_ID"),
-        client_secret=os.getenv("SPOTIFY_CLIENT_SECRET")
-    ))
+def get_spotify_client(prefix=None, access_token=None):
+    """
+    Authenticates with Spotify using Client Credentials Flow
+    prefix points the client at another API (e.g. a local stand-in server), access_token skips the login
+    The session has no retries of its own, the rate limiter below handles 429s and retries for every worker
+    """
+    if access_token:
+        auth = {'auth': access_token}
+    else:
+        auth = {'auth_manager': SpotifyClientCredentials(
+            client_id=os.getenv("SPOTIFY_CLIENT_ID"),
+            client_secret=os.getenv("SPOTIFY_CLIENT_SECRET")
+        )}
+
+    # a plain session hands a 429 straight back to us, with its Retry-After header
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONNECTIONS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    client = spotipy.Spotify(**auth, requests_session=session)
+    if prefix:
+        client.prefix = prefix
+    return client
+
+sp = get_spotify_client(os.getenv("SPOTIFY_API_PREFIX"), os.getenv("SPOTIFY_ACCESS_TOKEN"))
+
+# --- RATE LIMITING ---
+class TokenBucket:
+    """
+    Hands out request slots at a steady rate, shared by all the workers
+    After a 429 no slots go out until the time Spotify asked us to wait is over
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a slot"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    # paused, updated is when we may start again
+                    wait = self.updated - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hand out nothing for a while, then start again from an empty bucket"""
+        with self.lock:
+            self.updated = max(self.updated, time.monotonic() + seconds)
+            self.tokens = 0
+
+rate_limiter = TokenBucket()
+
+def call_spotify(method, *args, **kwargs):
+    """
+    Make one Spotify request through the rate limiter
+    429s pause every worker for as long as Retry-After says, server and network errors back off
+    and try again, anything else (403, 404, ...) is raised straight away
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        try:
+            return method(*args, **kwargs)
+        except SpotifyException as e:
+            if attempt == MAX_RETRIES:
+                raise
+            if e.http_status == 429:
+                retry_after = (e.headers or {}).get('Retry-After')
+                rate_limiter.pause(float(retry_after) if retry_after else BACKOFF_SECONDS * 2 ** attempt)
+                continue
+            if e.http_status is None or e.http_status < 500:
+                raise
+        except requests.exceptions.RequestException:
+            if attempt == MAX_RETRIES:
+                raise
+
+        # a little randomness so the workers don't all come back at the same moment
+        time.sleep(BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def run_requests(function, items, workers=ENRICH_WORKERS):
+    """Run function over items on a pool of workers, yielding the results in order"""
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        yield from executor.map(function, items)
+    finally:
+        # when the caller stops early (or dies) the requests that haven't started are dropped
+        executor.shutdown(cancel_futures=True)
+
+def format_duration(seconds):
+    """e.g. 1h 05m, 4m 30s or 12s"""
+    if not np.isfinite(seconds):
+        return "unknown"
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02}m"
+    if minutes:
+        return f"{minutes}m {seconds:02}s"
+    return f"{seconds}s"
+
+class Progress:
+    """Prints how far a phase got, how fast it goes and when it should be done, every few seconds"""
+
+    def __init__(self, label, total, interval=PROGRESS_SECONDS):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.start = self.printed = time.monotonic()
 
-sp = get_spotify_client()
+    def update(self, done):
+        now = time.monotonic()
+        if now - self.printed < self.interval and done < self.total:
+            return
+        self.printed = now
+
+        rate = done / (now - self.start) if now > self.start else 0
+        eta = (self.total - done) / rate if rate else float('inf')
+        print(f"   {done:,}/{self.total:,} {self.label} ({done / self.total:.0%}), "
+              f"{rate:.1f}/s, ETA {format_duration(eta)}")
 
 def load_unified_data():
     """Load the merged dataset from Phase 4"""
-    input_path = os.path.join(PROCESSED_DATA_FOLDER, "unified_music_history.parquet")
-    if not os.path.exists(input_path):
+    # src/transform is on the path when the enricher runs as a script, see the bottom of this file
+    from unified_history import UNIFIED_PATH, load_unified_history
+
+    if not os.path.exists(UNIFIED_PATH):
         print("❌ No unified data available.")
         return None
-    df = pd.read_parquet(input_path)
+    # adds the calendar columns when the merger didn't store them
+    df = load_unified_history(UNIFIED_PATH)
     print(f"✅ {len(df):,} total records loaded")
     return df
 
 def get_unique_tracks(df):
     """Get unique tracks that need enrichment"""
     print("📊 Grouping tracks...")
-    unique_tracks = df.groupby(['track', 'artist']).size().reset_index(name='play_count')
+
+    # the merged history keeps the spotify uri of every spotify listen, so those tracks never need a search
+    if 'spotify_uri' in df.columns:
+        spotify_ids = clean_spotify_ids(df['spotify_uri'])
+    else:
+        print("   ⚠️  No spotify_uri column, re-run the merger to look tracks up by ID")
+        spotify_ids = pd.Series(pd.NA, index=df.index, dtype='str')
+
+    aggregations = {
+        'play_count': ('spotify_id', 'size'),
+        'spotify_id': ('spotify_id', 'first'),
+    }
+    if 'video_id' in df.columns:
+        aggregations['video_id'] = ('video_id', 'first')
+
+    unique_tracks = df.assign(spotify_id=spotify_ids).groupby(['track', 'artist'], observed=True).agg(
+        **aggregations
+    ).reset_index()
     unique_tracks = unique_tracks.sort_values(by='play_count', ascending=False)
     print(f"   Found {len(unique_tracks):,} unique songs.")
+    print(f"   {unique_tracks['spotify_id'].notna().sum():,} of them already have a Spotify ID")
     
     print("\n🔥 Top 5 Most Played:")
     for _, row in unique_tracks.head(5).iterrows():
@@ -43,32 +237,52 @@ def get_unique_tracks(df):
     
     return unique_tracks
 
-def clean_spotify_id(spotify_id):
+def add_cached_video_ids(unique_tracks, video_ids):
     """
-    Clean Spotify ID to remove any prefixes
-    Returns None if ID is invalid
+    Fill in the spotify id of youtube tracks whose video was resolved on an earlier run,
+    and mark the ones whose search found nothing so they aren't searched again
     """
-    if not spotify_id:
-        return None
-    
-    sid = str(spotify_id).strip()
-    
-    # Filter out invalid IDs
-    if any(x in sid.lower() for x in ['local', 'episode', 'http', 'unknown']):
-        return None
-    
+    if 'video_id' not in unique_tracks.columns:
+        unique_tracks['known_missing'] = False
+        return unique_tracks
+
+    video_column = unique_tracks['video_id'].astype(object)
+    in_cache = video_column.isin(video_ids.keys())
+    cached_ids = video_column.map(video_ids)
+
+    unique_tracks['spotify_id'] = unique_tracks['spotify_id'].fillna(cached_ids)
+    unique_tracks['known_missing'] = in_cache & cached_ids.isna()
+
+    print(f"   {int(in_cache.sum()):,} YouTube videos already resolved on an earlier run")
+    return unique_tracks
+
+def clean_spotify_ids(spotify_ids):
+    """
+    Clean a column of Spotify IDs/URIs down to the bare track IDs
+    Invalid ones (local files, episodes, links) become missing
+    For categoricals only the distinct values get cleaned
+    """
+    spotify_ids = pd.Series(spotify_ids)
+
+    if isinstance(spotify_ids.dtype, pd.CategoricalDtype):
+        cleaned = clean_spotify_ids(pd.Series(spotify_ids.cat.categories)).to_numpy(dtype=object, na_value=None)
+        # code -1 (missing) picks the None slot on the end
+        cleaned = np.append(cleaned, None)
+        return pd.Series(cleaned[spotify_ids.cat.codes.to_numpy()], index=spotify_ids.index, dtype='str')
+
+    ids = spotify_ids.astype('str').str.strip()
+    invalid = ids.str.lower().str.contains(INVALID_ID_MARKERS, regex=True)
+
     # Remove spotify:track: prefix if present
-    if 'spotify:track:' in sid:
-        sid = sid.split('spotify:track:')[1]
-    
+    has_prefix = ids.str.contains(TRACK_URI_PREFIX, regex=False)
+    ids = ids.where(~has_prefix, ids.str.split(TRACK_URI_PREFIX, regex=False).str.get(1))
+
     # Remove any remaining colons or slashes
-    sid = sid.replace(':', '').replace('/', '')
-    
+    ids = ids.str.replace(r'[:/]', '', regex=True)
+
     # Spotify IDs are exactly 22 characters (Base62 encoding)
-    if len(sid) == 22 and sid.isalnum():
-        return sid
-    
-    return None
+    valid = ids.str.fullmatch(r'[A-Za-z0-9]{22}') & ~invalid
+    return ids.where(valid.fillna(False).astype(bool))
 
 def clean_artist_for_search(artist_name):
     """
@@ -91,67 +305,170 @@ def clean_artist_for_search(artist_name):
     return artist if artist else 'unknown'
 
 def search_track_on_spotify(track_name, artist_name):
-    """Search for a track on Spotify"""
+    """
+    Search for a track on Spotify
+    Returns the track, None when nothing was found, or SEARCH_FAILED when the search itself failed
+    (so only real misses get remembered)
+    """
     try:
         # Clean artist name before searching
         clean_artist = clean_artist_for_search(artist_name)
         query = f"track:{track_name} artist:{clean_artist}"
-        result = sp.search(q=query, type='track', limit=1)
-        if result['tracks']['items']:
-            return result['tracks']['items'][0]
+        result = call_spotify(sp.search, q=query, type='track', limit=1)
     except Exception:
-        pass
+        return SEARCH_FAILED
+    if result['tracks']['items']:
+        return result['tracks']['items'][0]
     return None
 
-def build_id_lookup():
+def chunks(items, size):
+    """Split a list into lists of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def fetch_chunk(method, chunk):
+    """One multi-ID request, returns the chunk with its results (None when the request failed)"""
+    try:
+        return chunk, call_spotify(method, chunk)
+    except Exception:
+        return chunk, None
+
+def fetch_tracks(spotify_ids, workers=ENRICH_WORKERS):
     """
-    Build a lookup table of Spotify IDs from cleaned data
-    Returns: dict mapping (track, artist) -> spotify_id
+    Full track objects for a list of Spotify IDs, 50 per request
+    Returns: dict mapping spotify_id -> track (IDs Spotify doesn't know are left out)
     """
-    spotify_clean_path = os.path.join(PROCESSED_DATA_FOLDER, "spotify_cleaned.parquet")
-    id_lookup = {}
-    
-    if not os.path.exists(spotify_clean_path):
-        return id_lookup
-    
-    print("⚡ Building ID lookup from Spotify history...")
-    df_spot = pd.read_parquet(spotify_clean_path)
-    
-    # Find URI column
-    uri_col = next((col for col in df_spot.columns if 'uri' in col.lower()), None)
-    
-    if not uri_col:
-        return id_lookup
-    
-    # Determine track/artist column names
-    if 'track_name_clean' in df_spot.columns:
-        track_col, artist_col = 'track_name_clean', 'artist_name_clean'
-    elif 'track_name_cleaned' in df_spot.columns:
-        track_col, artist_col = 'track_name_cleaned', 'artist_name_cleaned'
-    elif 'track' in df_spot.columns:
-        track_col, artist_col = 'track', 'artist'
-    else:
-        return id_lookup
-    
-    lookup_df = df_spot[[track_col, artist_col, uri_col]].dropna().drop_duplicates()
-    
-    for _, row in lookup_df.iterrows():
-        clean_id = clean_spotify_id(row[uri_col])
-        if clean_id:
-            key = (row[track_col], row[artist_col])
-            id_lookup[key] = clean_id
-    
-    print(f"   Cached {len(id_lookup):,} Spotify IDs!")
-    return id_lookup
+    tracks = {}
+    id_chunks = chunks(list(dict.fromkeys(spotify_ids)), TRACKS_PER_REQUEST)
+    get_tracks = lambda chunk: fetch_chunk(sp.tracks, chunk)
+
+    for chunk, result in run_requests(get_tracks, id_chunks, workers):
+        if not result:
+            continue
+        # the tracks come back in the order we asked for them, null for unknown IDs
+        for spotify_id, track_data in zip(chunk, result['tracks']):
+            if track_data:
+                tracks[spotify_id] = track_data
+    return tracks
+
+def fetch_artist_genres(artist_ids, workers=ENRICH_WORKERS):
+    """
+    Genres of every artist in a list of artist IDs, 50 per request
+    Returns: dict mapping artist_id -> "genre, genre" ('Unknown' when Spotify has none)
+    """
+    genres = {}
+    id_chunks = chunks(list(dict.fromkeys(artist_ids)), ARTISTS_PER_REQUEST)
+    get_artists = lambda chunk: fetch_chunk(sp.artists, chunk)
+
+    for chunk, result in run_requests(get_artists, id_chunks, workers):
+        if not result:
+            continue
+        for artist_id, artist_data in zip(chunk, result['artists']):
+            if artist_data and artist_data.get('genres'):
+                genres[artist_id] = ', '.join(artist_data['genres'])
+            else:
+                genres[artist_id] = 'Unknown'
+    return genres
+
+class LRUMemo:
+    """A dict that only keeps the maxsize most recently used entries"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+artist_genres_memo = LRUMemo(ARTIST_MEMO_SIZE)
+
+def resolve_artist_genres(artist_ids, cache, workers=ENRICH_WORKERS):
+    """
+    Genres of the distinct artists among artist_ids (one per track, None for tracks not found),
+    from the memo first, then the cache, and only then from Spotify, 50 per request
+    Returns: dict mapping artist_id -> "genre, genre"
+    """
+    distinct_ids = list(dict.fromkeys(artist_id for artist_id in artist_ids if artist_id))
+
+    genres = {}
+    for artist_id in distinct_ids:
+        memo_genres = artist_genres_memo.get(artist_id)
+        if memo_genres is not None:
+            genres[artist_id] = memo_genres
+    remembered = len(genres)
+
+    cached = cache.get('genres', [artist_id for artist_id in distinct_ids if artist_id not in genres])
+    new_ids = [artist_id for artist_id in distinct_ids if artist_id not in genres and artist_id not in cached]
+    fetched = fetch_artist_genres(new_ids, workers)
+    cache.put('genres', fetched)
+
+    for artist_id, artist_genres in {**cached, **fetched}.items():
+        genres[artist_id] = artist_genres
+        artist_genres_memo.put(artist_id, artist_genres)
+
+    requests_made = -(-len(new_ids) // ARTISTS_PER_REQUEST)
+    print(f"   {sum(1 for artist_id in artist_ids if artist_id):,} tracks by {len(distinct_ids):,} artists: "
+          f"{remembered:,} remembered, {len(cached):,} cached, {len(fetched):,} fetched in {requests_made:,} requests")
+    return genres
+
+def get_audio_features_batch(spotify_ids, workers=ENRICH_WORKERS):
+    """
+    Audio features for a list of Spotify IDs, 100 per request with several requests in flight
+    Returns: dict mapping spotify_id -> {energy, valence, danceability, tempo}, or None when Spotify
+    has no features for it. IDs whose request failed are left out, so they are asked again next time.
+    After a 403 every ID not answered yet is None, and AUDIO_FEATURES_REFUSED is in the dict too
+    """
+    features_map = {}
+    # Spotify answers 403 for apps that aren't allowed to use the endpoint, no point asking again
+    forbidden = threading.Event()
+
+    def fetch_features(chunk):
+        if forbidden.is_set():
+            return chunk, None
+        try:
+            return chunk, call_spotify(sp.audio_features, chunk) or []
+        except SpotifyException as e:
+            if e.http_status == 403:
+                forbidden.set()
+            return chunk, None
+        except Exception:
+            return chunk, None
+
+    distinct_ids = list(dict.fromkeys(spotify_ids))
+    id_chunks = chunks(distinct_ids, AUDIO_FEATURES_PER_REQUEST)
+    for chunk, results in run_requests(fetch_features, id_chunks, workers):
+        if results is None:
+            continue
+        # one entry per ID we asked for, null when spotify has no features for it
+        for spotify_id, features in zip(chunk, results):
+            features_map[spotify_id] = {name: features.get(name) for name in AUDIO_FEATURES} if features else None
+
+    if forbidden.is_set():
+        print("⚠️  Spotify refused the audio features request (403), continuing without them")
+        for spotify_id in distinct_ids:
+            features_map.setdefault(spotify_id, None)
+        features_map[AUDIO_FEATURES_REFUSED] = None
+
+    return features_map
 
 def extract_basic_metadata(track_data):
-    """Extract basic track metadata (NOT audio features)"""
+    """Extract basic track metadata (NOT audio features or genres)"""
     if not track_data:
         return None
     
     try:
-        metadata = {
+        return {
             'spotify_id': track_data['id'],
+            'spotify_artist_id': track_data['artists'][0]['id'],
             'spotify_artist_name': track_data['artists'][0]['name'].lower(),
             'album_name': track_data['album']['name'],
             'album_release_date': track_data['album']['release_date'],
@@ -160,29 +477,20 @@ def extract_basic_metadata(track_data):
             'explicit': track_data['explicit'],
             'duration_ms_spotify': track_data['duration_ms'],
         }
-        
-        # Get genres from artist
-        try:
-            artist_id = track_data['artists'][0]['id']
-            artist_data = sp.artist(artist_id)
-            if artist_data and 'genres' in artist_data and artist_data['genres']:
-                metadata['genres'] = ', '.join(artist_data['genres'])
-            else:
-                metadata['genres'] = 'Unknown'
-        except:
-            metadata['genres'] = 'Unknown'
-        
-        return metadata
     except Exception:
         return None
 
 
-def enrich_tracks_optimized(unique_tracks, sample_size=None):
+def enrich_tracks_optimized(unique_tracks, sample_size=None, workers=ENRICH_WORKERS, cache_path=CACHE_PATH):
     """
-    OPTIMIZED: Enrichment with batch processing
-    1. Build ID lookup
-    2. Search for missing tracks
-    3. Batch fetch ALL audio features at once
+    OPTIMIZED: Enrichment in batched stages
+    0. Take everything the cache still knows from earlier runs
+    1. Look up tracks we already know the Spotify ID of, 50 per request
+    2. Search for the rest
+    3. Resolve the genres of every distinct artist found (memo, cache, then 50 per request) and join them back
+    4. Batch fetch ALL audio features at once
+    Only new and expired tracks, artists and features go to Spotify, and every answer goes into the cache
+    Searches are saved every CHECKPOINT_SIZE tracks, so a run that dies resumes where it stopped
     """
     print("\n🔬 Starting OPTIMIZED enrichment...")
     
@@ -191,75 +499,129 @@ def enrich_tracks_optimized(unique_tracks, sample_size=None):
         print(f"⚠️  SAMPLE MODE: Only enriching {sample_size} tracks")
         unique_tracks = unique_tracks.head(sample_size)
     
-    total = len(unique_tracks)
+    cache = EnrichmentCache(cache_path)
+    cached_tracks = cache.get('tracks')
+    video_ids = cache.get('videos')
+    unique_tracks = add_cached_video_ids(unique_tracks, video_ids).reset_index(drop=True)
     
-    # Step 1: Build ID lookup
-    id_lookup = build_id_lookup()
-    
-    # Step 2: Find or search for all tracks
-    print(f"\n🔍 Phase 1: Finding tracks on Spotify...")
     enriched_data = []
-    tracks_needing_search = []
+    tracks_needing_lookup = []
+    from_cache = 0
     
-    for idx, row in unique_tracks.iterrows():
-        track_name = row['track']
-        artist_name = row['artist']
-        
-        metadata = None
-        lookup_key = (track_name, artist_name)
-        
-        # Try lookup first
-        if lookup_key in id_lookup:
-            spotify_id = id_lookup[lookup_key]
-            try:
-                track_data = sp.track(spotify_id)
-                metadata = extract_basic_metadata(track_data)
-            except:
-                pass
-        
-        # If not found, search
-        if not metadata:
-            track_data = search_track_on_spotify(track_name, artist_name)
-            if track_data:
-                metadata = extract_basic_metadata(track_data)
+    # Step 0: Tracks resolved on an earlier run
+    for position, row in enumerate(unique_tracks.itertuples(index=False)):
+        item = {'track': row.track, 'artist': row.artist, 'spotify_id': None}
+        enriched_data.append(item)
         
+        key = (row.track, row.artist)
+        if cached_tracks.get(key):
+            item.update(cached_tracks[key])
+            from_cache += 1
+        elif pd.notna(row.spotify_id) or key not in cached_tracks:
+            tracks_needing_lookup.append(position)
+    
+    print(f"\n💾 {from_cache:,} tracks found in the cache, "
+          f"{len(unique_tracks) - from_cache - len(tracks_needing_lookup):,} known to be missing from Spotify")
+    
+    # Step 1: Look up the tracks we have IDs for
+    known_ids = unique_tracks.loc[tracks_needing_lookup, 'spotify_id'].dropna().tolist()
+    print(f"\n⚡ Phase 1: Looking up {len(known_ids):,} tracks by ID...")
+    found_tracks = fetch_tracks(known_ids, workers)
+    
+    tracks_needing_search = []
+    found_by_id = {}
+    
+    for position in tracks_needing_lookup:
+        item = enriched_data[position]
+        spotify_id = unique_tracks.at[position, 'spotify_id']
+        metadata = extract_basic_metadata(found_tracks.get(spotify_id)) if pd.notna(spotify_id) else None
         if metadata:
-            enriched_data.append({
-                'track': track_name,
-                'artist': artist_name,
-                **metadata
-            })
-        else:
-            # Track not found
-            enriched_data.append({
-                'track': track_name,
-                'artist': artist_name,
-                'spotify_id': None,
-                'genres': 'Unknown'
-            })
+            item.update(metadata)
+            found_by_id[(item['track'], item['artist'])] = metadata
         
-        # Progress
-        if (len(enriched_data)) % 50 == 0:
-            print(f"   {len(enriched_data)}/{total} tracks processed...")
+        # If not found, search (unless an earlier search for this track or video found nothing)
+        elif (item['track'], item['artist']) not in cached_tracks and not unique_tracks.at[position, 'known_missing']:
+            tracks_needing_search.append(position)
+    
+    cache.put('tracks', found_by_id)
+    
+    # Step 2: Search for the rest, several searches at a time
+    print(f"\n🔍 Phase 2: Searching for {len(tracks_needing_search):,} tracks ({workers} at a time)...")
+    
+    search = lambda position: search_track_on_spotify(enriched_data[position]['track'], enriched_data[position]['artist'])
+    search_results = run_requests(search, tracks_needing_search, workers)
     
+    searched_tracks = {}
+    searched_videos = {}
+    progress = Progress("tracks searched", len(tracks_needing_search))
+    
+    def checkpoint():
+        cache.put('tracks', searched_tracks)
+        cache.put('videos', searched_videos)
+        searched_tracks.clear()
+        searched_videos.clear()
+    
+    try:
+        for searched, (position, track_data) in enumerate(zip(tracks_needing_search, search_results), 1):
+            # a failed search says nothing about the track, it gets searched again next run
+            if track_data is not SEARCH_FAILED:
+                item = enriched_data[position]
+                metadata = extract_basic_metadata(track_data)
+                if metadata:
+                    item.update(metadata)
+                searched_tracks[(item['track'], item['artist'])] = metadata
+                
+                # remember what this video turned out to be
+                video_id = unique_tracks.at[position, 'video_id'] if 'video_id' in unique_tracks.columns else None
+                if pd.notna(video_id):
+                    searched_videos[video_id] = item['spotify_id']
+            
+            if len(searched_tracks) >= CHECKPOINT_SIZE:
+                checkpoint()
+            progress.update(searched)
+    finally:
+        # keep what was searched so far even when the run dies, a restart picks up from here
+        search_results.close()
+        checkpoint()
     print(f"✅ Found {sum(1 for d in enriched_data if d.get('spotify_id'))} tracks on Spotify")
     
-    # Step 3: Batch fetch ALL audio features at once
-    print(f"\n🎵 Phase 2: Fetching audio features (BATCH MODE)...")
+    # Step 3: Genres belong to the artists, each distinct artist is resolved once
+    print(f"\n🎸 Phase 3: Resolving genres per artist...")
+    genres = resolve_artist_genres([d.get('spotify_artist_id') for d in enriched_data], cache, workers)
     
-    spotify_ids = [d['spotify_id'] for d in enriched_data if d.get('spotify_id')]
+    # Step 4: Batch fetch ALL audio features at once
+    print(f"\n🎵 Phase 4: Fetching audio features (BATCH MODE)...")
     
-    if spotify_ids:
-        print(f"   Fetching features for {len(spotify_ids)} tracks...")
-        features_map = get_audio_features_batch(spotify_ids)
-        print(f"   Retrieved {len(features_map)} audio feature sets")
-        
-        # Step 4: Merge audio features back into enriched data
-        for item in enriched_data:
-            if item.get('spotify_id') and item['spotify_id'] in features_map:
-                item.update(features_map[item['spotify_id']])
+    spotify_ids = {d['spotify_id'] for d in enriched_data if d.get('spotify_id')}
+    # tracks without features are cached too (as None), so they aren't asked for every run
+    features_map = cache.get('audio_features')
+    new_ids = [spotify_id for spotify_id in spotify_ids if spotify_id not in features_map]
+    
+    if new_ids and AUDIO_FEATURES_REFUSED in features_map:
+        print(f"   Spotify refused audio features recently (403), not asking for {len(new_ids)} tracks")
+    elif new_ids:
+        print(f"   Fetching features for {len(new_ids)} tracks ({len(spotify_ids) - len(new_ids):,} cached)...")
+        new_features = get_audio_features_batch(new_ids, workers)
+        print(f"   Retrieved {sum(1 for features in new_features.values() if features)} audio feature sets")
+        cache.put('audio_features', new_features)
+        features_map.update(new_features)
+    
+    # Merge audio features back into enriched data
+    for item in enriched_data:
+        if item.get('spotify_id') and features_map.get(item['spotify_id']):
+            item.update(features_map[item['spotify_id']])
+    
+    cache.close()
     
-    return pd.DataFrame(enriched_data)
+    enriched_df = pd.DataFrame(enriched_data)
+    
+    # join the genres of each artist back onto its tracks
+    if 'spotify_artist_id' in enriched_df.columns:
+        enriched_df['genres'] = enriched_df['spotify_artist_id'].map(genres).fillna('Unknown')
+    else:
+        enriched_df['genres'] = 'Unknown'
+    
+    return enriched_df
 
 def merge_enriched_data(original_df, enriched_df):
     """Merge enriched metadata back into listening history"""
@@ -329,7 +691,7 @@ def save_enriched_data(df):
     print(f"   Total columns: {len(df.columns)}")
     return output_path
 
-def run_enrichment(sample_mode=False, sample_size=50):
+def run_enrichment(sample_mode=False, sample_size=50, workers=ENRICH_WORKERS):
     """Main enrichment orchestrator"""
     print("🔬 PHASE 5: OPTIMIZED ENRICHMENT")
     print("Fetching genres, moods, and audio features from Spotify!\n")
@@ -347,7 +709,8 @@ def run_enrichment(sample_mode=False, sample_size=50):
     # Enrich (OPTIMIZED!)
     enriched_df = enrich_tracks_optimized(
         unique_tracks,
-        sample_size=sample_size if sample_mode else None
+        sample_size=sample_size if sample_mode else None,
+        workers=workers
     )
     
     # Merge back
@@ -364,6 +727,9 @@ def run_enrichment(sample_mode=False, sample_size=50):
     print("\n✨ ENRICHMENT COMPLETE! ✨")
 
 if __name__ == "__main__":
+    # the unified history is read the way the transform stage stores it
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "transform"))
+
     print("="*70)
     print("SAMPLE MODE: Test with 50 tracks first!")
     print("="*70 + "\n")
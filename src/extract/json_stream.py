@@ -0,0 +1,68 @@
+import re
+import json
+
+# how many characters we read from the file at a time
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = re.compile(r"\s*")
+
+# what a number cut off at the end of the buffer can still be followed by ("0." of "0.5")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*")
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield the elements of a top level JSON array one at a time,
+    so the whole file never has to sit in memory
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size)
+    eof = not buffer
+
+    # the file has to start with the opening bracket of the array
+    pos = _WHITESPACE.match(buffer).end()
+    while pos == len(buffer) and not eof:
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = _WHITESPACE.match(buffer).end()
+
+    if pos == len(buffer):
+        return
+    if buffer[pos] != "[":
+        raise ValueError("expected a JSON array at the start of the file")
+    pos += 1
+    # only right after the opening bracket may the array end straight away
+    first = True
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+
+        if first and pos < len(buffer) and buffer[pos] == "]":
+            return
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            after = _WHITESPACE.match(buffer, end).end()
+
+            # an element only counts once we see the comma or bracket after it,
+            # until then it might be cut off by the end of the buffer (e.g. a number)
+            if after < len(buffer) and buffer[after] in ",]":
+                yield element
+                if buffer[after] == "]":
+                    return
+                pos = after + 1
+                first = False
+                continue
+
+            cut_off = _NUMBER_TAIL.match(buffer, after).end() == len(buffer)
+            if eof or not cut_off:
+                raise ValueError(f"expected ',' or ']' after an array element at position {after}")
+        except json.JSONDecodeError:
+            if eof:
+                raise
+
+        # the next element is only partly in the buffer, so read some more
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
@@ -0,0 +1,128 @@
+import os
+import json
+import hashlib
+import posixpath
+import pyarrow.parquet as pq
+
+HASH_CHUNK_SIZE = 1 << 20
+
+def load_manifest(manifest_path):
+    """
+    Load the record of which raw files were already ingested
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_manifest(manifest, manifest_path):
+    """
+    Save the manifest, writing to a temp file first so a crash never leaves half a manifest
+    """
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def hash_file(path):
+    """
+    sha256 of the file contents, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def key_name(key):
+    """
+    The file name a manifest key stands for, older manifests keyed files by path or archive::member
+    """
+    return posixpath.basename(key.split("::")[-1].replace("\\", "/"))
+
+def adopt_old_keys(manifest, sources):
+    """
+    Move the entries of older manifests (keyed by path or archive::member) to the file name the
+    source is keyed by now. The moved entry has no fingerprint, so the file is parsed again
+    and record_ingested_file deletes every old part of it, including those of other exports
+    """
+    names = {source.key for source in sources}
+    for key in list(manifest):
+        name = key_name(key)
+        if key == name or name not in names:
+            continue
+
+        parts = manifest.pop(key)['parts']
+        old_parts = manifest.get(name, {}).get('parts', [])
+        manifest[name] = {'size': None, 'mtime_ns': None, 'content_hash': None, 'parts': old_parts + parts}
+
+def find_changed_files(manifest, sources, parser_version=None):
+    """
+    Return (source, fingerprint) for every raw file (see raw_sources) that is new or changed
+    since the last run. Files whose size and mtime match the manifest are skipped without being hashed.
+    Bumping parser_version makes every file that was parsed by an older version count as changed
+    """
+    adopt_old_keys(manifest, sources)
+    changed = []
+
+    for source in sources:
+        size, mtime_ns = source.stat()
+        entry = manifest.get(source.key)
+
+        # parsed before the output changed, so its parts have to be written again
+        if entry and entry.get('parser_version') != parser_version:
+            entry = None
+
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            continue
+
+        fingerprint = {
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'content_hash': source.content_hash(),
+        }
+        if parser_version is not None:
+            fingerprint['parser_version'] = parser_version
+
+        # touched but not actually changed (e.g. copied again), nothing to re-parse
+        if entry and entry.get('content_hash') == fingerprint['content_hash']:
+            entry.update(fingerprint)
+            continue
+
+        changed.append((source, fingerprint))
+
+    return changed
+
+def part_name(source, fingerprint):
+    """
+    Name of the parquet part that holds the rows of one raw file
+    """
+    stem = os.path.splitext(source.name)[0]
+    digest = hashlib.sha256(f"{source.key}|{fingerprint['content_hash']}".encode()).hexdigest()
+    return f"{stem}-{digest[:12]}.parquet"
+
+def record_ingested_file(manifest, manifest_path, dataset_folder, source, fingerprint, parts):
+    """
+    Point the manifest at the new parts of a raw file and delete the parts of its old version.
+    Parts of raw files that were removed from the raw folder are kept on purpose
+    """
+    old_parts = manifest.get(source.key, {}).get('parts', [])
+    for old_part in old_parts:
+        if old_part not in parts:
+            old_path = os.path.join(dataset_folder, old_part)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    manifest[source.key] = {**fingerprint, 'parts': parts}
+    save_manifest(manifest, manifest_path)
+
+def dataset_row_count(manifest, dataset_folder):
+    """
+    Count the rows in the dataset from the parquet footers, without reading any data
+    """
+    return sum(
+        pq.ParquetFile(os.path.join(dataset_folder, part)).metadata.num_rows
+        for entry in manifest.values()
+        for part in entry['parts']
+    )
@@ -0,0 +1,117 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+COMPRESSION = "zstd"
+
+# rows per row group, small enough to read one month cheaply but big enough to compress well
+ROW_GROUP_SIZE = 128 * 1024
+
+# the most rows held back across all months before the fullest one is written out early
+MAX_BUFFERED_ROWS = ROW_GROUP_SIZE
+
+def split_by_month(table):
+    """
+    Yield (year, month, rows) for every month that appears in the timestamp column.
+    Rows without a timestamp can't be placed in a partition and are dropped
+    """
+    table = table.filter(pc.is_valid(table['timestamp']))
+    if table.num_rows == 0:
+        return
+
+    keys = pc.add(
+        pc.multiply(pc.year(table['timestamp']), 100),
+        pc.month(table['timestamp']),
+    )
+
+    # a stable sort keeps the original order of the rows inside each month
+    order = pc.sort_indices(keys)
+    table = table.take(order)
+    keys = keys.take(order)
+
+    offset = 0
+    for item in pc.value_counts(keys):
+        key = item['values'].as_py()
+        count = item['counts'].as_py()
+        yield key // 100, key % 100, table.slice(offset, count)
+        offset += count
+
+class PartitionedWriter:
+    """
+    Writes the listens of one raw file into a source=/year=/month= partitioned dataset,
+    one file per month. Rows are buffered per month so row groups come out close to ROW_GROUP_SIZE,
+    but never more than max_buffered_rows in total, so memory doesn't grow with the file
+    """
+
+    def __init__(self, dataset_folder, source, basename, max_buffered_rows=MAX_BUFFERED_ROWS):
+        self.dataset_folder = dataset_folder
+        self.source = source
+        self.basename = basename
+        self.max_buffered_rows = max_buffered_rows
+        self.buffers = {}
+        self.buffered_rows = {}
+        self.writers = {}
+        self.rows = 0
+
+    def part_path(self, key):
+        """Path of the finished file for a (year, month), relative to the dataset folder"""
+        year, month = key
+        return os.path.join(f"source={self.source}", f"year={year}", f"month={month}", self.basename)
+
+    def temp_path(self, key):
+        """Files are written under a hidden name first, so a half written file is never read as data"""
+        folder, filename = os.path.split(self.part_path(key))
+        return os.path.join(self.dataset_folder, folder, "_" + filename)
+
+    def write(self, table):
+        for year, month, rows in split_by_month(table):
+            key = (year, month)
+            self.buffers.setdefault(key, []).append(rows)
+            self.buffered_rows[key] = self.buffered_rows.get(key, 0) + rows.num_rows
+            self.rows += rows.num_rows
+
+            if self.buffered_rows[key] >= ROW_GROUP_SIZE:
+                self.flush(key)
+
+        # past the cap the fullest month goes out as a smaller row group
+        while sum(self.buffered_rows.values()) > self.max_buffered_rows:
+            self.flush(max(self.buffered_rows, key=self.buffered_rows.get))
+
+    def flush(self, key):
+        table = pa.concat_tables(self.buffers.pop(key))
+        self.buffered_rows.pop(key)
+
+        if key not in self.writers:
+            temp_path = self.temp_path(key)
+            os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+            self.writers[key] = pq.ParquetWriter(temp_path, table.schema, compression=COMPRESSION)
+
+        self.writers[key].write_table(table, row_group_size=ROW_GROUP_SIZE)
+
+    def close(self):
+        """
+        Flush what is left, move the finished files into place
+        and return their paths relative to the dataset folder
+        """
+        for key in list(self.buffers):
+            self.flush(key)
+
+        parts = []
+        for key, writer in self.writers.items():
+            writer.close()
+            os.replace(self.temp_path(key), os.path.join(self.dataset_folder, self.part_path(key)))
+            parts.append(self.part_path(key))
+
+        self.writers = {}
+        return sorted(parts)
+
+    def abort(self):
+        """Throw away everything written so far"""
+        for key, writer in self.writers.items():
+            writer.close()
+            os.remove(self.temp_path(key))
+
+        self.writers = {}
+        self.buffers = {}
+        self.buffered_rows = {}
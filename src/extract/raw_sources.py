@@ -0,0 +1,98 @@
+import io
+import os
+import zipfile
+import calendar
+import posixpath
+from contextlib import contextmanager
+
+from manifest import hash_file
+
+class RawFile:
+    """
+    A history file that was already unpacked into the raw folder
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        # keyed by name, so the same file unpacked or inside any export is one entry in the manifest
+        self.key = self.name
+
+    def open(self):
+        return open(self.path, 'r', encoding='utf-8')
+
+    def stat(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def content_hash(self):
+        return "sha256:" + hash_file(self.path)
+
+class ZipMember:
+    """
+    A history file inside a downloaded export archive.
+    It is decompressed while it is being read, nothing is extracted to disk
+    """
+
+    def __init__(self, archive_path, member_name):
+        self.archive_path = archive_path
+        self.member_name = member_name
+        self.name = posixpath.basename(member_name)
+        self.key = self.name
+
+    @contextmanager
+    def open(self):
+        with zipfile.ZipFile(self.archive_path) as archive:
+            with archive.open(self.member_name) as member:
+                yield io.TextIOWrapper(member, encoding='utf-8')
+
+    def info(self):
+        with zipfile.ZipFile(self.archive_path) as archive:
+            return archive.getinfo(self.member_name)
+
+    def stat(self):
+        info = self.info()
+        mtime_ns = calendar.timegm(info.date_time + (0, 0, 0)) * 1_000_000_000
+        return info.file_size, mtime_ns
+
+    def content_hash(self):
+        # the archive already stores a checksum of every member, so nothing has to be read
+        return f"crc32:{self.info().CRC:08x}"
+
+def find_raw_sources(folder, matches, archives=None):
+    """
+    Return every history file whose name passes matches(), both the unpacked ones in folder
+    and the ones inside zip archives (every .zip in folder unless archives is given).
+    Every file name is returned once: an unpacked file wins over a zipped copy of it,
+    and a newer archive wins over an older export that has the same file
+    """
+    sources = [
+        RawFile(os.path.join(folder, filename))
+        for filename in sorted(os.listdir(folder))
+        if matches(filename)
+    ]
+    found = {source.key for source in sources}
+
+    if archives is None:
+        archives = [
+            os.path.join(folder, filename)
+            for filename in os.listdir(folder)
+            if filename.lower().endswith(".zip")
+        ]
+    archives = sorted(archives, key=lambda path: (os.path.getmtime(path), path), reverse=True)
+
+    for archive_path in archives:
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                member_names = sorted(archive.namelist())
+        except zipfile.BadZipFile as e:
+            print(f"error reading {os.path.basename(archive_path)}: {e}")
+            continue
+
+        for member_name in member_names:
+            member = ZipMember(archive_path, member_name)
+            if matches(member.name) and member.key not in found:
+                found.add(member.key)
+                sources.append(member)
+
+    return sorted(sources, key=lambda source: source.key)
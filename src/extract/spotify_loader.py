@@ -1,63 +1,259 @@
 import os
 import json
-import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
+
+from json_stream import iter_json_array
+from manifest import (
+    load_manifest, save_manifest, find_changed_files, part_name,
+    record_ingested_file, dataset_row_count,
+)
+from partitioned_writer import PartitionedWriter, MAX_BUFFERED_ROWS
+from raw_sources import find_raw_sources
 
 RAW_DATA_FOLDER = os.path.join("data", "raw")
 PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
 
-def load_spotify_data():
-    print('looking for spotify files')
+# every year of listens from every source, partitioned as source=/year=/month=
+LISTENS_FOLDER = os.path.join(PROCESSED_DATA_FOLDER, "listens")
+MANIFEST_PATH = os.path.join(LISTENS_FOLDER, "_spotify_manifest.json")
+
+# how many listens we hold in memory at once in streaming mode
+BATCH_SIZE = 50_000
+
+# how many files we parse at the same time in parallel mode (None = one per core)
+MAX_WORKERS = None
+
+COLUMN_RENAMES = {
+    'master_metadata_track_name': 'track_name',
+    'master_metadata_album_artist_name': 'artist_name',
+    'master_metadata_album_album_name': 'album_name',
+    'spotify_track_uri': 'spotify_uri',
+    'ts': 'timestamp',
+    'ms_played': 'duration_ms',
+}
+
+# every field spotify documents for the extended streaming history (after the renames above),
+# including the ones only older or newer exports have. Every part is written with all of them,
+# so a column never goes missing because the first file read didn't have it
+KNOWN_TYPES = {
+    'timestamp': pa.timestamp('ns', tz='UTC'),
+    'username': pa.string(),
+    'platform': pa.string(),
+    'duration_ms': pa.int64(),
+    'conn_country': pa.string(),
+    'ip_addr': pa.string(),
+    'ip_addr_decrypted': pa.string(),
+    'user_agent_decrypted': pa.string(),
+    'track_name': pa.string(),
+    'artist_name': pa.string(),
+    'album_name': pa.string(),
+    'spotify_uri': pa.string(),
+    'episode_name': pa.string(),
+    'episode_show_name': pa.string(),
+    'spotify_episode_uri': pa.string(),
+    'audiobook_title': pa.string(),
+    'audiobook_uri': pa.string(),
+    'audiobook_chapter_uri': pa.string(),
+    'audiobook_chapter_title': pa.string(),
+    'reason_start': pa.string(),
+    'reason_end': pa.string(),
+    'shuffle': pa.bool_(),
+    'skipped': pa.bool_(),
+    'offline': pa.bool_(),
+    'offline_timestamp': pa.int64(),
+    'incognito_mode': pa.bool_(),
+}
+
+SPOTIFY_SCHEMA = pa.schema(list(KNOWN_TYPES.items()))
+
+def is_spotify_file(filename):
+    return filename.startswith("Streaming_History_Audio_") and filename.endswith(".json")
+
+def find_spotify_files(archives=None):
+    """
+    Return all the spotify history files, unpacked in the raw folder or inside the export zips
+    """
+    # sorted so the output comes out in the same order on every run
+    return find_raw_sources(RAW_DATA_FOLDER, is_spotify_file, archives)
+
+def field_names(records):
+    """Every field any of the records has, in the order they first show up"""
+    return list(dict.fromkeys(name for record in records for name in record))
+
+def scan_field_names(source):
+    """Every field used anywhere in a history file, read without keeping the records"""
+    names = {}
+    with source.open() as file:
+        for record in iter_json_array(file):
+            names.update(dict.fromkeys(record))
+    return list(names)
+
+def spotify_schema(names):
+    """
+    The schema for a file with these raw field names: every known field, then the fields
+    spotify added that we don't know about yet, kept as text
+    """
+    renamed = dict.fromkeys(COLUMN_RENAMES.get(name, name) for name in names)
+    return pa.schema(list(SPOTIFY_SCHEMA) + [
+        pa.field(name, pa.string())
+        for name in renamed if name not in KNOWN_TYPES
+    ])
+
+def raw_type(name, records):
+    """The arrow type a raw field is read as"""
+    known_type = KNOWN_TYPES.get(COLUMN_RENAMES.get(name, name))
+    if known_type is None:
+        return pa.array([record.get(name) for record in records]).type
+    return pa.string() if pa.types.is_timestamp(known_type) else known_type
+
+def records_to_table(records, schema=None):
+    """
+    Turn a list of raw spotify records into an arrow table of listens.
+    Records don't all have the same fields, so the columns come from every record, not the first one
+    """
+    names = list(records[0]) if records else []
+
+    if set().union(*records) == set(names):
+        # usually every record has the same fields, then arrow can take them from the first one
+        table = pa.Table.from_pylist(records)
+    else:
+        # otherwise every field has to be named, the known ones with their types (ts as text, cast below)
+        names = field_names(records)
+        table = pa.Table.from_pylist(records, schema=pa.schema([
+            pa.field(name, raw_type(name, records))
+            for name in names
+        ]))
+
+    if schema is None:
+        schema = spotify_schema(names)
+    table = table.rename_columns([COLUMN_RENAMES.get(name, name) for name in table.column_names])
+
+    # line the columns up with the schema before casting
+    columns = [
+        table.column(field.name) if field.name in table.column_names else pa.nulls(len(table), field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, names=schema.names).cast(schema)
 
-    all_files_in_folder = os.listdir(RAW_DATA_FOLDER)
-    master_songs_list = []
+def iter_spotify_batches(source, batch_size=BATCH_SIZE):
+    """
+    Read one history file record by record and yield arrow tables of at most batch_size listens.
+    The field names are collected in a first pass, so a field that only shows up in a later batch
+    is still a column of every batch (and the parts match the ones a whole-file read writes)
+    """
+    schema = spotify_schema(scan_field_names(source))
+    with source.open() as file:
+        records = []
+        for record in iter_json_array(file):
+            records.append(record)
+            if len(records) == batch_size:
+                yield records_to_table(records, schema)
+                records = []
 
-    for filename in all_files_in_folder:
-        if filename.startswith("Streaming_History_Audio_") and filename.endswith(".json"):
-            full_path = os.path.join(RAW_DATA_FOLDER, filename)
-            print(f"Reading {filename}")
+        if records:
+            yield records_to_table(records, schema)
 
-            try:
-                with open(full_path, 'r', encoding= 'utf-8') as file:
-                    data = json.load(file)
-                    master_songs_list.extend(data)
-            
-            except Exception as e:
-                print(f"error reading {filename}: {e}")
+def extract_spotify_file(source):
+    """
+    Read, rename, convert and filter one history file.
+    Runs inside a worker process in parallel mode, so errors are returned instead of raised
+    """
+    try:
+        with source.open() as file:
+            data = json.load(file)
+        return records_to_table(data), None
 
-    if not master_songs_list:
+    except Exception as e:
+        return None, e
+
+def read_spotify_files(sources, streaming=False, workers=1):
+    """
+    Yield the (table, error) result of every file in order.
+    In streaming mode the files are parsed while they are written, so there is nothing to yield
+    """
+    if streaming:
+        yield from (None for _ in sources)
+    elif workers == 1:
+        yield from map(extract_spotify_file, sources)
+    else:
+        # every file is parsed in its own process, map() hands the results back in file order
+        with ProcessPoolExecutor(max_workers=workers or MAX_WORKERS) as executor:
+            yield from executor.map(extract_spotify_file, sources)
+
+def write_spotify_parts(source, fingerprint, result, streaming=False, batch_size=BATCH_SIZE):
+    """
+    Write the listens of one history file into the partitioned dataset.
+    In streaming mode the records are parsed one at a time and written out in batches,
+    so memory depends on batch_size and not on the export size
+    """
+    # in streaming mode the writer holds at most a batch worth of rows as well
+    max_buffered_rows = batch_size if streaming else MAX_BUFFERED_ROWS
+    writer = PartitionedWriter(LISTENS_FOLDER, "spotify", part_name(source, fingerprint), max_buffered_rows)
+
+    try:
+        if streaming:
+            for table in iter_spotify_batches(source, batch_size):
+                writer.write(table)
+        else:
+            table, error = result
+            if error is not None:
+                raise error
+            writer.write(table)
+    except Exception:
+        writer.abort()
+        raise
+
+    return writer.close(), writer.rows
+
+def load_spotify_data(streaming=False, batch_size=BATCH_SIZE, workers=1, archives=None):
+    """
+    Extract every spotify history file into the partitioned dataset.
+    archives is a list of export zips to read, by default every zip in the raw folder
+    """
+    print('looking for spotify files')
+
+    all_files = find_spotify_files(archives)
+    if not all_files:
         print("No Files Found")
         return
-    
-    df = pd.DataFrame(master_songs_list)
-
-        # Rename columns
-    df = df.rename(columns={
-        'master_metadata_track_name': 'track_name',
-        'master_metadata_album_artist_name': 'artist_name',
-        'master_metadata_album_album_name': 'album_name',
-        'spotify_track_uri': 'spotify_uri',
-        'ts': 'timestamp',
-        'ms_played': 'duration_ms',
-    })
-
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-    df_2025 = df[df['timestamp'].dt.year == 2025].copy()
-
-        # 3. Check if we have data left
-    if df_2025.empty:
-        print("After filtering, there are no songs left for 2025.")
-        print("(Check if your JSON files actually cover the year 2025!)")
+
+    os.makedirs(LISTENS_FOLDER, exist_ok= True)
+    manifest = load_manifest(MANIFEST_PATH)
+
+    # only files that are new or changed since the last run get parsed again
+    changed_files = find_changed_files(manifest, all_files)
+    print(f"{len(all_files) - len(changed_files)} files unchanged since the last run")
+
+    if not changed_files:
+        save_manifest(manifest, MANIFEST_PATH)
+        print("Nothing new to ingest")
         return
-    else:
-        print(f"Filter Success! We threw away old songs.")
-        print(f"Songs remaining for 2025: {len(df_2025)}")
 
-    os.makedirs(PROCESSED_DATA_FOLDER, exist_ok= True)
-    save_path = os.path.join(PROCESSED_DATA_FOLDER, "Spotify_history_2025.parquet")
+    changed_sources = [source for source, _ in changed_files]
+    results = read_spotify_files(changed_sources, streaming, workers)
+
+    new_rows = 0
+    for (source, fingerprint), result in zip(changed_files, results):
+        try:
+            parts, rows = write_spotify_parts(source, fingerprint, result, streaming, batch_size)
+        except Exception as e:
+            print(f"error reading {source.name}: {e}")
+            continue
+
+        print(f"Read {source.name}: {rows} songs")
+        record_ingested_file(manifest, MANIFEST_PATH, LISTENS_FOLDER, source, fingerprint, parts)
+        new_rows += rows
+
+    total_rows = dataset_row_count(manifest, LISTENS_FOLDER)
+
+    if total_rows == 0:
+        print("No songs found in any of the files.")
+        return
 
-    df_2025.to_parquet(save_path)
-    print(f"Saved 2025 data to: {save_path}")
+    print(f"New songs: {new_rows}")
+    print(f"Songs across all years: {total_rows}")
+    print(f"Saved spotify data to: {os.path.join(LISTENS_FOLDER, 'source=spotify')}")
 
 if __name__ == "__main__":
     load_spotify_data()
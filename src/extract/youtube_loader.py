@@ -1,67 +1,161 @@
 import os
-import json
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
+from json_stream import iter_json_array
+from manifest import load_manifest, save_manifest, find_changed_files, part_name, record_ingested_file
+from partitioned_writer import PartitionedWriter
+from raw_sources import find_raw_sources
+
+RAW_DATA_FOLDER = os.path.join("data", "raw")
 PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
 
-def load_youtube_data():
+# every year of listens from every source, partitioned as source=/year=/month=
+LISTENS_FOLDER = os.path.join(PROCESSED_DATA_FOLDER, "listens")
+MANIFEST_PATH = os.path.join(LISTENS_FOLDER, "_youtube_manifest.json")
+
+# how many music listens we hold in memory before writing them out
+BATCH_SIZE = 50_000
+
+# bump when the columns we write change, so files ingested by an older version get parsed again
+PARSER_VERSION = 2
 
+# the 11 character id in links like https://music.youtube.com/watch?v=dQw4w9WgXcQ
+VIDEO_ID = r"[?&]v=(?P<video_id>[A-Za-z0-9_-]{11})"
+
+def find_youtube_files(archives=None):
+    """
+    Return every watch-history.json, unpacked in the raw folder or inside the takeout zips
+    """
+    return find_raw_sources(RAW_DATA_FOLDER, lambda filename: filename == "watch-history.json", archives)
+
+def load_youtube_data(archives=None, years=None):
+    """
+    Extract the music listens of every watch history into the partitioned dataset.
+    archives is a list of takeout zips to read, by default every zip in the raw folder.
+    years limits which years are kept (e.g. {2025}), by default all of them
+    """
     print('looking for youtube watch history file')
-    filepath = os.path.join("data",  "raw", "watch-history.json")
+    all_files = find_youtube_files(archives)
 
     #checking if watch-history exists
-    if not os.path.exists(filepath):
+    if not all_files:
         print("No Files Found")
         return
-    
-    #opening the file and loading it into a dataframe
-    try:
-        with open(filepath, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-    except Exception as e:
-        print(f"error reading watch-history.json: {e}")
+
+    os.makedirs(LISTENS_FOLDER, exist_ok=True)
+    manifest = load_manifest(MANIFEST_PATH)
+
+    # skip the whole parse for files that were already ingested (with the same years kept)
+    changed_files = find_changed_files(manifest, all_files, ingest_version(years))
+    if not changed_files:
+        save_manifest(manifest, MANIFEST_PATH)
+        print("watch-history.json is unchanged since the last run, nothing new to ingest")
         return
-    
-    print(f"{len(data)} rows found")
 
-    # loading into a dataframe
-    df = pd.DataFrame(data)
+    for source, fingerprint in changed_files:
+        load_youtube_file(manifest, source, fingerprint, years)
+
+def ingest_version(years=None):
+    """
+    What the parts of a file depend on besides its contents: the parser version and the years kept,
+    so a run that keeps other years than the last one parses the file again
+    """
+    if years is None:
+        return PARSER_VERSION
+    return [PARSER_VERSION, sorted(years)]
+
+def iter_music_batches(source, years=None, batch_size=BATCH_SIZE, stats=None):
+    """
+    Stream a watch history and yield arrow tables of its YouTube Music listens.
+    Everything else is dropped while reading, and only the fields we use are kept.
+    The counts of rows read, music rows and rows kept go into stats
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'rows': 0, 'music_rows': 0, 'kept_rows': 0})
+    columns = {'track_name': [], 'artist_name': [], 'timestamp': [], 'titleUrl': []}
+
+    with source.open() as file:
+        for entry in iter_json_array(file):
+            stats['rows'] += 1
 
-    # since watch-history.json contain all youtube data, we filter to get only music data
-    if 'header' in df.columns:
-        music_df = df[df['header'] == "YouTube Music"].copy()
-        print(f" found only {len(music_df)} rows of music data")
-    else: 
-        music_df = df.copy()
+            # since watch-history.json contain all youtube data, we keep only music data
+            if entry.get('header') != "YouTube Music":
+                continue
+            stats['music_rows'] += 1
 
-    # cleaning the title column by removing "watched " to get only the track name
-    music_df['track_name'] = music_df['title'].str.replace("Watched ", "", regex=False)
+            # the time is in UTC and starts with the year, so this check needs no date parsing
+            time = entry.get('time')
+            if years is not None and (not time or int(time[:4]) not in years):
+                continue
 
-    # converting the time column to the appropriate dtype
-    music_df['timestamp'] = pd.to_datetime(music_df['time'], format="ISO8601")
+            stats['kept_rows'] += 1
 
-    # extracting the artist name from the subtitle colummn using a function
-    def get_artist_name(subtitle_cell):
-        if isinstance(subtitle_cell, list) and len(subtitle_cell) > 0:
-            return subtitle_cell[0].get('name')
-        return "unknown"
-    
-    music_df['artist_name'] = music_df['subtitles'].apply(get_artist_name)
-    music_df['artist_name'] = music_df['artist_name'].str.replace(" - Topic", "", regex=False)
+            # removing "watched " to get only the track name
+            title = entry.get('title')
+            columns['track_name'].append(title.replace("Watched ", "") if title is not None else None)
 
-    #filtering for music listended to in only 2025
-    df_2025 = music_df[music_df['timestamp'].dt.year == 2025].copy()
+            # the artist is the name of the first subtitle
+            subtitles = entry.get('subtitles')
+            if isinstance(subtitles, list) and len(subtitles) > 0:
+                artist_name = subtitles[0].get('name')
+                if artist_name is not None:
+                    artist_name = artist_name.replace(" - Topic", "")
+            else:
+                artist_name = "unknown"
+            columns['artist_name'].append(artist_name)
 
-    # Select only the columns we need
-    final_df = df_2025[['track_name', 'artist_name', 'timestamp', 'titleUrl']]
+            columns['timestamp'].append(time)
+            columns['titleUrl'].append(entry.get('titleUrl'))
 
-    #saving final file
-    save_path = os.path.join(PROCESSED_DATA_FOLDER, "youtube_history_2025.parquet")
-    final_df.to_parquet(save_path)
+            if len(columns['timestamp']) == batch_size:
+                yield columns_to_table(columns)
+                columns = {name: [] for name in columns}
 
-    print(f"saved to {save_path}, found {len(final_df)} songs")
+    if columns['timestamp']:
+        yield columns_to_table(columns)
+
+def columns_to_table(columns):
+    """
+    Build the arrow table for a batch of music listens, converting the time strings
+    and keeping only the video id out of each link
+    """
+    video_ids = pc.extract_regex(pa.array(columns['titleUrl'], pa.string()), pattern=VIDEO_ID)
+
+    return pa.table({
+        'track_name': pa.array(columns['track_name'], pa.string()),
+        'artist_name': pa.array(columns['artist_name'], pa.string()),
+        'timestamp': pa.array(columns['timestamp'], pa.string()).cast(pa.timestamp('ns', tz='UTC')),
+        'video_id': pc.struct_field(video_ids, [0]),
+    })
+
+def load_youtube_file(manifest, source, fingerprint, years=None):
+    """
+    Parse one watch history and write its music listens into the dataset
+    """
+    # the writer holds at most a batch worth of rows, like the reader
+    writer = PartitionedWriter(LISTENS_FOLDER, "youtube", part_name(source, fingerprint), BATCH_SIZE)
+    stats = {}
+
+    try:
+        for table in iter_music_batches(source, years, stats=stats):
+            writer.write(table)
+    except Exception as e:
+        writer.abort()
+        print(f"error reading {source.key}: {e}")
+        return
+
+    parts = writer.close()
+    print(f"{stats['rows']} rows found")
+    print(f" found only {stats['music_rows']} rows of music data")
+    if years is not None:
+        print(f" kept {stats['kept_rows']} of them from {', '.join(map(str, sorted(years)))}")
+
+    # the new parts replace the ones from the previous version of the file
+    record_ingested_file(manifest, MANIFEST_PATH, LISTENS_FOLDER, source, fingerprint, parts)
+
+    print(f"saved to {os.path.join(LISTENS_FOLDER, 'source=youtube')}, found {writer.rows} songs")
 
 if __name__ == "__main__":
     load_youtube_data()
-    
-
@@ -1,8 +1,73 @@
 import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import re
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from name_cache import NameCache, rules_version
 
 PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
+LISTENS_FOLDER = os.path.join(PROCESSED_DATA_FOLDER, "listens")
+
+# the year we are making the Wrapped for, only its partitions get read
+WRAPPED_YEAR = 2025
+
+# bump this when the cleaning code changes, so names cached by the old code are cleaned again
+CLEANING_REVISION = 1
+
+# ids that repeat on every replay of a track, kept as categoricals so each one is stored once
+ID_COLUMNS = ['spotify_uri', 'video_id']
+
+# the hive partition keys of the listens dataset, only needed for finding the files
+PARTITION_COLUMNS = ['year', 'month']
+
+# the cleaned name columns and the id columns are written as dictionaries with this type
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# things to cut off the end of track names, the name ends where the first of them starts
+THINGS_TO_REMOVE = [
+    '(feat.', '(ft.', '(featuring', '(with', '(official video)',
+    '(official audio)', '(official music video)', '(lyric video)','(lyric video)', '(lyrics)',
+    '(lyric)', '(audio)', '(video)', '(visualizer)', '(visualiser)',
+    '(original version)', '(radio version)', '(radio edit)', '(album version)',
+    '(remix)', '(extended version)', '(extended mix)', '(remastered)', '[',
+    '[official video]', '[official audio]', '[lyrics]', '[lyric video]',
+    ' ft ', ' feat', '(official visualiser)', ' ft.', '(lyric visualizer)'
+]
+
+# things to remove from artist names, in this order
+ARTIST_REMOVALS = [
+    " - topic",
+    "- topic",
+    " topic",
+    "atvevo",
+    "vevo", 
+    " official",
+    "official"
+]
+
+# everything python's str.split() and str.strip() count as whitespace, spelled out
+# so the arrow (RE2) patterns below agree with the python cleaning functions
+PYTHON_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680"
+    "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a"
+    "\u2028\u2029\u202f\u205f\u3000"
+)
+
+# cutting at the earliest marker gives the same result as the loop in clean_track_name,
+# because no marker can start inside another marker that comes later in the list
+TRACK_MARKERS = "(?s)(?:" + "|".join(re.escape(marker) for marker in THINGS_TO_REMOVE) + ").*"
+# only the runs that aren't already a single space, so most names don't match at all
+WHITESPACE_RUNS = (
+    "[" + PYTHON_WHITESPACE.replace(" ", "") + "][" + PYTHON_WHITESPACE + "]*"
+    "| [" + PYTHON_WHITESPACE + "]+"
+)
+AFTER_FIRST_COMMA = "(?s),.*"
 
 def clean_track_name(track_name):
     if pd.isna(track_name) or track_name == "":
@@ -11,20 +76,8 @@ def clean_track_name(track_name):
     # converting track name to string and lower case
     track_name = str(track_name)
 
-
-    # creating a list of things to remove from track name
-    things_to_remove = [
-        '(feat.', '(ft.', '(featuring', '(with', '(official video)',
-        '(official audio)', '(official music video)', '(lyric video)','(lyric video)', '(lyrics)',
-        '(lyric)', '(audio)', '(video)', '(visualizer)', '(visualiser)',
-        '(original version)', '(radio version)', '(radio edit)', '(album version)',
-        '(remix)', '(extended version)', '(extended mix)', '(remastered)', '[',
-        '[official video]', '[official audio]', '[lyrics]', '[lyric video]',
-        ' ft ', ' feat', '(official visualiser)', ' ft.', '(lyric visualizer)'
-    ]
-
     # looping through the list to remove any of the markers if theyy exist
-    for marker in things_to_remove:
+    for marker in THINGS_TO_REMOVE:
         if marker in track_name:
             track_name = track_name.split(marker)[0] # picking the track name only in the list created
 
@@ -44,18 +97,7 @@ def clean_artist_name(artist_name):
     # convert to lowercase
     artist_name = str(artist_name).lower()
 
-    # List of things to remove
-    removals = [
-        " - topic",
-        "- topic",
-        " topic",
-        "atvevo",
-        "vevo", 
-        " official",
-        "official"
-    ]
-
-    for item in removals:
+    for item in ARTIST_REMOVALS:
         artist_name = artist_name.replace(item, "")
 
     # handling multiple artists
@@ -64,25 +106,296 @@ def clean_artist_name(artist_name):
 
     return artist_name if artist_name else "unknown"
 
-def clean_spotify_data():
+def to_arrow_strings(values):
+    """
+    A pandas column as an arrow string array, with NaN/None as nulls
+    """
+    return pa.array(values, type=pa.string(), from_pandas=True)
+
+def to_series(cleaned, like):
+    """
+    Back from arrow to a pandas column with the same index as the input
+    """
+    return cleaned.to_pandas().set_axis(like.index).rename(like.name)
+
+def or_unknown(names):
+    """
+    Missing and empty names become "unknown", like in the row functions
+    """
+    empty = pc.fill_null(pc.equal(names, ""), True)
+    return pc.if_else(empty, "unknown", names)
+
+def clean_track_names(track_names):
+    """
+    clean_track_name for a whole column at once, using arrow compute kernels
+    instead of a python loop per row
+    """
+    names = to_arrow_strings(track_names)
+
+    # cut at the first marker, then tidy up the spaces and the edges
+    names = pc.replace_substring_regex(names, TRACK_MARKERS, "")
+    names = pc.replace_substring_regex(names, WHITESPACE_RUNS, " ")
+    names = pc.utf8_trim(names, PYTHON_WHITESPACE)
+    names = pc.utf8_trim(names, " ._-")
+
+    return to_series(or_unknown(names), track_names)
+
+def clean_artist_names(artist_names):
+    """
+    clean_artist_name for a whole column at once, using arrow compute kernels
+    """
+    names = to_arrow_strings(artist_names)
+
+    # arrow only lowercases ascii the way python does, so the few names
+    # with other characters are lowercased by python instead
+    lowered = pc.ascii_lower(names)
+    not_ascii = pc.fill_null(pc.invert(pc.string_is_ascii(names)), False)
+    if pc.any(not_ascii).as_py():
+        python_lowered = [name.lower() for name in pc.filter(names, not_ascii).to_pylist()]
+        lowered = pc.replace_with_mask(lowered, not_ascii, pa.array(python_lowered, type=pa.string()))
+    names = lowered
+
+    # one pass per item, so removing one can't create a new match for an earlier one
+    for item in ARTIST_REMOVALS:
+        names = pc.replace_substring(names, item, "")
+
+    # handling multiple artists
+    names = pc.replace_substring_regex(names, AFTER_FIRST_COMMA, "")
+
+    return to_series(or_unknown(names), artist_names)
+
+def clean_distinct(values, clean_column, cache=None):
+    """
+    Clean only the distinct values of a column and map the results back through the codes.
+    A history has far fewer distinct names than plays, and the result is a categorical
+    so later groupbys work on integer codes instead of strings.
+    With a NameCache, names cleaned in earlier runs aren't cleaned again
+    """
+    codes, uniques = pd.factorize(values)
+    distinct = pd.Series(uniques, dtype=object)
+
+    if cache is None:
+        cleaned = clean_column(distinct).to_numpy(dtype=object)
+    else:
+        cleaned = cache.clean(distinct, clean_column).to_numpy(dtype=object)
+
+    # the missing values get their own slot at the end, which is "unknown"
+    cleaned = np.append(cleaned, "unknown")
+    codes[codes == -1] = len(uniques)
+
+    # different raw names can clean to the same name, so the cleaned ones are factorized again
+    cleaned_codes, categories = pd.factorize(cleaned)
+
+    cleaned = pd.Categorical.from_codes(cleaned_codes[codes], categories)
+    return pd.Series(cleaned, index=values.index, name=values.name)
+
+def load_name_caches():
+    """
+    The on disk caches for track and artist names, versioned by the rules that produce them
+    """
+    track_cache = NameCache("track", rules_version(THINGS_TO_REMOVE, CLEANING_REVISION))
+    artist_cache = NameCache("artist", rules_version(ARTIST_REMOVALS, CLEANING_REVISION))
+    return track_cache, artist_cache
+
+def add_cleaned_columns(df, track_cache, artist_cache):
+    """
+    Add the cleaned track and artist columns, and make the id columns categoricals.
+    Each distinct name is only cleaned once, and not at all if an earlier run already did it
+    """
+    df['track_name_cleaned'] = clean_distinct(df['track_name'], clean_track_names, track_cache)
+    df['artist_name_cleaned'] = clean_distinct(df['artist_name'], clean_artist_names, artist_cache)
+
+    for column in ID_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+
+    return df
+
+def clean_names(df):
     """
-    Load, clean and save spotify data
+    Add the cleaned track and artist columns, going through the name caches
+    """
+    track_cache, artist_cache = load_name_caches()
+    df = add_cleaned_columns(df, track_cache, artist_cache)
+
+    for cache in [track_cache, artist_cache]:
+        cache.report()
+        cache.save()
+
+    return df
+
+# each worker process loads the name caches once and keeps them for all its chunks
+worker_caches = None
+
+def start_worker():
+    global worker_caches
+    worker_caches = load_name_caches()
+
+def to_dictionary_array(categorical):
+    """A pandas categorical column as an arrow dictionary array"""
+    return pa.DictionaryArray.from_arrays(
+        pa.array(categorical.cat.codes.to_numpy(), type=pa.int32(), mask=categorical.isna().to_numpy()),
+        pa.array(categorical.cat.categories, type=pa.string()),
+    )
+
+def distinct_names(column):
+    """The distinct non-missing names of an arrow column"""
+    return pc.drop_null(pc.unique(column)).to_pylist()
+
+def clean_row_group(path, row_group, schema):
+    """
+    Clean one row group of the input in a worker process.
+    The rows stay in arrow (a pandas round trip would turn int and bool columns with nulls into
+    floats and objects), only the name columns go through the caches, and the result is cast to schema.
+    Returns the cleaned rows, plus the names this chunk added to the worker's caches, the names it used
+    and its hit/miss counts, so the main process can keep the on disk caches up to date
+    """
+    track_cache, artist_cache = worker_caches
+    sizes = [len(track_cache.entries), len(artist_cache.entries)]
+    counts = [(track_cache.hits, track_cache.misses), (artist_cache.hits, artist_cache.misses)]
+
+    table = pq.ParquetFile(path).read_row_group(row_group)
+
+    cleaned = {
+        'track_name_cleaned': clean_distinct(table['track_name'].to_pandas(), clean_track_names, track_cache),
+        'artist_name_cleaned': clean_distinct(table['artist_name'].to_pandas(), clean_artist_names, artist_cache),
+    }
+
+    # columns this raw file didn't have are all null, everything gets the types of schema
+    columns = []
+    for field in schema:
+        if field.name in cleaned:
+            column = to_dictionary_array(cleaned[field.name])
+        elif field.name in table.column_names:
+            column = table[field.name]
+        else:
+            column = pa.nulls(table.num_rows, field.type)
+        columns.append(column.cast(field.type))
+    table = pa.Table.from_arrays(columns, schema=schema)
+
+    new_names = [cache.entries.iloc[size:] for cache, size in zip(worker_caches, sizes)]
+    used_names = [distinct_names(table['track_name']), distinct_names(table['artist_name'])]
+    new_counts = [
+        (cache.hits - hits, cache.misses - misses)
+        for cache, (hits, misses) in zip(worker_caches, counts)
+    ]
+    return table, new_names, used_names, new_counts
+
+def cleaned_schema(input_path):
+    """
+    The schema of the cleaned output: every column of the source's parts,
+    the id columns as dictionaries and the two cleaned name columns
+    """
+    fields = [
+        field.with_type(DICTIONARY_TYPE) if field.name in ID_COLUMNS else field
+        for field in dataset_schema(input_path)
+        if field.name not in PARTITION_COLUMNS
+    ]
+    return pa.schema(fields + [
+        pa.field('track_name_cleaned', DICTIONARY_TYPE),
+        pa.field('artist_name_cleaned', DICTIONARY_TYPE),
+    ])
+
+def list_row_groups(input_path, year=WRAPPED_YEAR):
+    """
+    (file, row group) for every row group in the year's partitions, in file order
+    """
+    dataset = ds.dataset(input_path, format="parquet", partitioning="hive")
+    row_groups = []
+    for fragment in dataset.get_fragments(filter=ds.field('year') == year):
+        for row_group in range(pq.ParquetFile(fragment.path).num_row_groups):
+            row_groups.append((fragment.path, row_group))
+    return sorted(row_groups)
+
+def clean_in_chunks(input_path, save_path, workers=None):
+    """
+    Clean the year's row groups in parallel worker processes and stream the cleaned ones
+    to save_path in input order. Only a few row groups are in memory at any time
+    """
+    row_groups = list_row_groups(input_path)
+    workers = workers or os.cpu_count()
+    track_cache, artist_cache = load_name_caches()
+
+    # one schema for every chunk, decided before any of them is read
+    schema = cleaned_schema(input_path)
+    writer = pq.ParquetWriter(save_path, schema)
+    total_rows = 0
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=start_worker) as executor:
+            pending = deque()
+            next_row_group = 0
+
+            while next_row_group < len(row_groups) or pending:
+                # keep every worker busy, with one extra chunk queued for each
+                while next_row_group < len(row_groups) and len(pending) < workers * 2:
+                    pending.append(executor.submit(clean_row_group, *row_groups[next_row_group], schema))
+                    next_row_group += 1
+
+                table, new_names, used_names, new_counts = pending.popleft().result()
+                writer.write_table(table)
+                total_rows += table.num_rows
+
+                caches = [track_cache, artist_cache]
+                for cache, names, used, (hits, misses) in zip(caches, new_names, used_names, new_counts):
+                    cache.merge(names)
+                    cache.touch(used)
+                    cache.hits += hits
+                    cache.misses += misses
+    finally:
+        writer.close()
+
+    for cache in [track_cache, artist_cache]:
+        cache.report()
+        cache.save()
+
+    print(f"cleaned {total_rows} records in {len(row_groups)} chunks")
+    return total_rows
+
+def dataset_schema(input_path):
+    """
+    One schema covering every part of a source. Parts from newer exports can have columns
+    older ones don't, and a plain read would take the columns of just one of them
+    """
+    dataset = ds.dataset(input_path, format="parquet", partitioning="hive")
+    return pa.unify_schemas([dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()])
+
+def load_year(input_path, year=WRAPPED_YEAR):
+    """
+    Read one year of a source from the partitioned dataset
+    """
+    dataset = ds.dataset(input_path, schema=dataset_schema(input_path), format="parquet", partitioning="hive")
+    df = dataset.to_table(filter=ds.field('year') == year).to_pandas()
+
+    # the partition keys are only needed for finding the files
+    return df.drop(columns=PARTITION_COLUMNS)
+
+def clean_spotify_data(chunked=False, workers=None):
+    """
+    Load, clean and save spotify data.
+    chunked cleans the row groups in worker processes instead of loading the whole year
     """
     # get the path for the file to be cleaned
-    input_path = os.path.join(PROCESSED_DATA_FOLDER, "spotify_history_2025.parquet")
+    input_path = os.path.join(LISTENS_FOLDER, "source=spotify")
 
     # check if the file exists
     if not os.path.exists(input_path):
         print("No spotify file found")
         return None
+
+    save_path = os.path.join(PROCESSED_DATA_FOLDER, "spotify_cleaned.parquet")
+
+    if chunked:
+        clean_in_chunks(input_path, save_path, workers)
+        print("cleaned spotify data saved")
+        return None
     
-    #load the file into a dataframe
-    df = pd.read_parquet(input_path)
+    #load the year we want into a dataframe, the other years' partitions are never opened
+    df = load_year(input_path)
     print(f"loaded {len(df)} spotify records")
 
     #clean the track name and artist name columns
-    df['track_name_cleaned'] = df['track_name'].apply(clean_track_name)
-    df['artist_name_cleaned'] = df['artist_name'].apply(clean_artist_name)
+    df = clean_names(df)
 
     #check the cleaning that was done
     if len(df) > 0:
@@ -92,31 +405,37 @@ def clean_spotify_data():
             print(f"Cleaned: {rows['track_name_cleaned']} | {rows['artist_name_cleaned']}")
             print()
 
-    save_path = os.path.join(PROCESSED_DATA_FOLDER, "spotify_cleaned.parquet")
     df.to_parquet(save_path, index=False)
     print("cleaned spotify data saved")
 
     return df
 
-def clean_youtube_data():
+def clean_youtube_data(chunked=False, workers=None):
     """
-    Load, clean and save youtube data
+    Load, clean and save youtube data.
+    chunked cleans the row groups in worker processes instead of loading the whole year
     """
     # get the path for the file to be cleaned
-    input_path = os.path.join(PROCESSED_DATA_FOLDER, "youtube_history_2025.parquet")
+    input_path = os.path.join(LISTENS_FOLDER, "source=youtube")
 
     # check if the file exists
     if not os.path.exists(input_path):
         print("No youtube file found")
         return None
+
+    save_path = os.path.join(PROCESSED_DATA_FOLDER, "youtube_cleaned.parquet")
+
+    if chunked:
+        clean_in_chunks(input_path, save_path, workers)
+        print("cleaned youtube data saved")
+        return None
     
-    #load the file into a dataframe
-    df = pd.read_parquet(input_path)
+    #load the year we want into a dataframe, the other years' partitions are never opened
+    df = load_year(input_path)
     print(f"loaded {len(df)} youtube records")
 
     #clean the track name and artist name columns
-    df['track_name_cleaned'] = df['track_name'].apply(clean_track_name)
-    df['artist_name_cleaned'] = df['artist_name'].apply(clean_artist_name)
+    df = clean_names(df)
 
     #check the cleaning that was done
     if len(df) > 0:
@@ -126,7 +445,6 @@ def clean_youtube_data():
             print(f"Cleaned: {rows['track_name_cleaned']} | {rows['artist_name_cleaned']}")
             print()
 
-    save_path = os.path.join(PROCESSED_DATA_FOLDER, "youtube_cleaned.parquet")
     df.to_parquet(save_path, index=False)
     print("cleaned youtube data saved")
 
@@ -0,0 +1,138 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+
+PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
+UNIFIED_PATH = os.path.join(PROCESSED_DATA_FOLDER, "unified_music_history.parquet")
+
+# the most keys one summary keeps, so the memory per user stays fixed however long the history gets.
+# any key played more than total / CAPACITY times is always kept
+CAPACITY = 2_000
+BATCH_SIZE = 256 * 1024
+TOP_N = 5
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters: approximate play counts for at most `capacity` keys.
+    Every count is an overestimate by at most its error, so the true plays of a key
+    are between count - error and count
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='int64')
+        self.errors = pd.Series(dtype='int64')
+        self.total = 0
+
+    def floor(self):
+        """The most plays a key we aren't keeping could have"""
+        return int(self.counts.min()) if len(self.counts) >= self.capacity else 0
+
+    def update(self, batch_counts):
+        """
+        Add the exact counts of one batch (a series of plays per key).
+        Keys we weren't keeping start from the floor, since they could have been
+        played that often before, then the smallest counts get dropped to fit the capacity
+        """
+        batch_counts = batch_counts[batch_counts > 0]
+        self.total += int(batch_counts.sum())
+        floor = self.floor()
+
+        # an empty summary takes the shape of the keys (e.g. a (track, artist) multiindex) from the first batch
+        if not len(self.counts):
+            self.counts = self.errors = batch_counts.iloc[:0].astype('int64')
+
+        counts = self.counts.add(batch_counts, fill_value=0).astype('int64')
+        new_keys = ~counts.index.isin(self.counts.index)
+        counts[new_keys] += floor
+        errors = self.errors.reindex(counts.index).fillna(floor).astype('int64')
+
+        if len(counts) > self.capacity:
+            kept = counts.nlargest(self.capacity, keep='first').index
+            counts = counts[kept]
+            errors = errors[kept]
+
+        self.counts = counts
+        self.errors = errors
+
+    def top(self, n=TOP_N):
+        """
+        The n keys with the highest counts, with their error and whether they are
+        certainly in the true top n (their lowest possible count beats every other key's highest)
+        """
+        ranked = self.counts.sort_values(ascending=False, kind='stable')
+        top = pd.DataFrame({
+            'plays': ranked.head(n),
+            'error': self.errors[ranked.index[:n]],
+        })
+        top['lower_bound'] = top['plays'] - top['error']
+
+        # highest count anything outside the top n could have
+        runner_up = max(int(ranked.iloc[n]) if len(ranked) > n else 0, self.floor())
+        top['guaranteed'] = top['lower_bound'] >= runner_up
+
+        return top
+
+    def max_error(self):
+        """Upper bound on how much any count is overestimated by"""
+        return self.floor()
+
+def iter_history_batches(path=UNIFIED_PATH, columns=None, batch_size=BATCH_SIZE):
+    """
+    Record batches of the unified history as dataframes, so the whole file is never in memory
+    """
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+def batch_counts(batch, key_columns):
+    """Exact plays per key within one batch"""
+    return batch.groupby(key_columns, observed=True).size()
+
+def stream_top_n(batches, keys, user_column=None, capacity=CAPACITY):
+    """
+    Space-Saving summaries filled from a stream of batches, one per kind of key (keys maps
+    a label to its key columns) and per user, or a single user when there is no user column
+    """
+    summaries = {label: {} for label in keys}
+
+    for batch in batches:
+        if user_column is None:
+            user_batches = [(None, batch)]
+        else:
+            user_batches = batch.groupby(user_column, observed=True)
+
+        for user, user_batch in user_batches:
+            for label, key_columns in keys.items():
+                if user not in summaries[label]:
+                    summaries[label][user] = SpaceSaving(capacity)
+                summaries[label][user].update(batch_counts(user_batch, key_columns))
+
+    return summaries
+
+def show_top_n(summary, label, n=TOP_N):
+    print(f"\n Top {n} {label} (streamed, plays are within the shown error):")
+    for key, row in summary.top(n).iterrows():
+        name = " by ".join(str(part).title() for part in key) if isinstance(key, tuple) else str(key).title()
+        certain = "" if row['guaranteed'] else " (not certain)"
+        print(f"  {row['plays']:3} plays (±{row['error']}) - {name}{certain}")
+
+def run_heavy_hitters(path=UNIFIED_PATH, user_column=None, capacity=CAPACITY, top_n=TOP_N):
+    """
+    Top tracks and artists of every user from the unified history, in bounded memory
+    """
+    columns = ['track', 'artist'] + ([user_column] if user_column else [])
+    batches = iter_history_batches(path, columns)
+
+    summaries = stream_top_n(batches, {'Tracks': ['track', 'artist'], 'Artists': 'artist'}, user_column, capacity)
+
+    for user, tracks in summaries['Tracks'].items():
+        print(f"\n{'='*70}")
+        print(f"{user if user is not None else 'All listens'}: {tracks.total:,} listens, counts off by at most {tracks.max_error():,}")
+        show_top_n(tracks, "Tracks", top_n)
+        show_top_n(summaries['Artists'][user], "Artists", top_n)
+
+    return summaries
+
+if __name__ == "__main__":
+    run_heavy_hitters()
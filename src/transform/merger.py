@@ -1,7 +1,22 @@
 import os
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from summary import summarize, print_summary
+from rollup import update_cube
+from track_matcher import resolve_keys
+from unified_history import PROCESSED_DATA_FOLDER, UNIFIED_PATH, CALENDAR_COLUMNS, add_columns
 
-PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
+# set to False to leave the calendar columns out of the saved file,
+# load_unified_history then works them out from the timestamps when it is read
+STORE_CALENDAR_COLUMNS = True
+
+# youtube logs when a video started and spotify when a track stopped, so spotify listens are
+# compared by their start (ts - duration_ms). the same song closer together than this is one listen
+DUPLICATE_TOLERANCE = pd.Timedelta(seconds=60)
+
+# 'drop' removes the youtube copy of a listen spotify also has, 'flag' keeps it with duplicate=True
+DUPLICATE_MODE = 'drop'
 
 def load_clean_data():
     """
@@ -27,46 +42,53 @@ def load_clean_data():
 
     return spotify_df, youtube_df
 
-def prepare_for_merge(spotify_df, youtube_df):
+def source_column(source, length):
     """
-    This function takes both dataframes and prepares them for mergeing
+    A column holding the same source name on every row, stored as one category
     """
-    if spotify_df is not None:
-        spotify_prepared = spotify_df[[
-            'timestamp',
-            'track_name_cleaned',
-            'artist_name_cleaned',
-            'duration_ms',
-            'skipped'
-        ]].copy()
+    return pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), categories=[source])
 
-        spotify_prepared['source'] = 'spotify'
+def missing_column(length):
+    """
+    A categorical column with nothing in it, for fields a source doesn't have
+    """
+    return pd.Categorical.from_codes(np.full(length, -1, dtype=np.int8), categories=pd.Index([], dtype='str'))
 
-        spotify_prepared = spotify_prepared.rename(columns = {
-            'track_name_cleaned': 'track',
-            'artist_name_cleaned': 'artist'
-        })
+def prepare_for_merge(spotify_df, youtube_df):
+    """
+    This function takes both dataframes and prepares them for mergeing.
+    The prepared frames reuse the cleaned columns instead of copying them
+    """
+    if spotify_df is not None:
+        spotify_prepared = pd.DataFrame({
+            'timestamp': spotify_df['timestamp'],
+            'track': spotify_df['track_name_cleaned'],
+            'artist': spotify_df['artist_name_cleaned'],
+            'duration_ms': spotify_df['duration_ms'],
+            'skipped': spotify_df['skipped'],
+            'source': source_column('spotify', len(spotify_df)),
+            # kept so enrichment can look tracks up by id instead of searching for them
+            'spotify_uri': spotify_df['spotify_uri'].astype('category'),
+            'video_id': missing_column(len(spotify_df)),
+        }, copy=False)
 
         print(f"Spotify: {len(spotify_prepared):,} records prepared")
     else:
         spotify_prepared = None
     
     if youtube_df is not None:
-        youtube_prepared = youtube_df[[
-            'track_name_cleaned',
-            'artist_name_cleaned',
-            'timestamp'
-        ]].copy()
-
-        youtube_prepared['source'] = "youtube music"
-
-        youtube_prepared = youtube_prepared.rename(columns = {
-            'track_name_cleaned': 'track',
-            'artist_name_cleaned': 'artist'
-        })
-
-        youtube_prepared['duration_ms'] = None
-        youtube_prepared['skipped'] = None
+        # youtube doesn't tell us how long we listened or if we skipped
+        youtube_prepared = pd.DataFrame({
+            'timestamp': youtube_df['timestamp'],
+            'track': youtube_df['track_name_cleaned'],
+            'artist': youtube_df['artist_name_cleaned'],
+            'duration_ms': pd.array([pd.NA] * len(youtube_df), dtype='Int64'),
+            'skipped': pd.array([pd.NA] * len(youtube_df), dtype='boolean'),
+            'source': source_column('youtube music', len(youtube_df)),
+            'spotify_uri': missing_column(len(youtube_df)),
+            # the video a youtube listen came from, enrichment remembers which spotify track each one is
+            'video_id': youtube_df['video_id'].astype('category') if 'video_id' in youtube_df.columns else missing_column(len(youtube_df)),
+        }, copy=False)
 
         print(f"YouTube: {len(youtube_prepared):,} records prepared")
     else:
@@ -74,120 +96,176 @@ def prepare_for_merge(spotify_df, youtube_df):
 
     return spotify_prepared, youtube_prepared
 
-def merge_datasets(spotifty_prepared, youtube_prepared):
-    dfs_to_merge = []
+def share_categories(dfs, columns):
+    """
+    Give the categorical columns of every dataframe the same categories
+    """
+    for column in columns:
+        if not all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in dfs):
+            continue
 
-    if spotifty_prepared is not None:
-        dfs_to_merge.append(spotifty_prepared)
-    
-    if youtube_prepared is not None:
-        dfs_to_merge.append(youtube_prepared)
+        categories = union_categoricals([df[column] for df in dfs]).categories
+        for df in dfs:
+            df[column] = df[column].cat.set_categories(categories)
 
-    if not dfs_to_merge:
-        print("No datasets to merge")
-        return None
-    
-    merged_df = pd.concat(dfs_to_merge, ignore_index=True)
+def match_tracks(*prepared_dfs):
+    """
+    Map near-duplicate (track, artist) keys, e.g. the same song named slightly
+    differently on spotify and youtube, to one key across all sources
+    """
+    dfs = [df for df in prepared_dfs if df is not None]
+    if not dfs:
+        return prepared_dfs
+
+    # the spotify uris keep keys of different recordings apart
+    share_categories(dfs, ['track', 'artist', 'spotify_uri'])
+    if all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in dfs for column in ['track', 'artist']):
+        resolve_keys(dfs)
+
+    return prepared_dfs
+
+def pair_keys(df):
+    """One int64 per (track, artist) from the category codes, -1 when either is missing"""
+    track_codes = df['track'].cat.codes.to_numpy(dtype=np.int64)
+    artist_codes = df['artist'].cat.codes.to_numpy(dtype=np.int64)
+    keys = track_codes * len(df['artist'].cat.categories) + artist_codes
+    keys[(track_codes < 0) | (artist_codes < 0)] = -1
+    return keys
+
+def find_duplicate_listens(spotify_df, youtube_df, tolerance=DUPLICATE_TOLERANCE):
+    """
+    Mask of the youtube rows that are a listen spotify has too: the same (track, artist)
+    starting within the tolerance. Both sides are sorted by start time once and matched
+    with an as-of join, so this is O(n log n) instead of comparing every pair
+    """
+    share_categories([spotify_df, youtube_df], ['track', 'artist'])
+
+    duration = spotify_df['duration_ms'].fillna(0).to_numpy(dtype=np.int64)
+    starts = spotify_df['timestamp'] - pd.to_timedelta(duration, unit='ms')
+    spotify_starts = pd.DataFrame({
+        'start': starts,
+        'spotify_start': starts,
+        'key': pair_keys(spotify_df),
+        'spotify_row': np.arange(len(spotify_df)),
+    })
+    youtube_starts = pd.DataFrame({
+        'start': youtube_df['timestamp'],
+        'key': pair_keys(youtube_df),
+        'youtube_row': np.arange(len(youtube_df)),
+    })
+    spotify_starts = spotify_starts[spotify_starts['key'] >= 0].sort_values('start', kind='stable')
+    youtube_starts = youtube_starts[youtube_starts['key'] >= 0].sort_values('start', kind='stable')
+
+    matches = pd.merge_asof(
+        youtube_starts, spotify_starts,
+        on='start', by='key', direction='nearest', tolerance=tolerance,
+    ).dropna(subset=['spotify_row'])
+
+    # one spotify listen can only explain one youtube row, the closest one
+    matches['gap'] = (matches['start'] - matches['spotify_start']).abs()
+    matches = matches.sort_values('gap', kind='stable').drop_duplicates('spotify_row')
+
+    duplicate = np.zeros(len(youtube_df), dtype=bool)
+    duplicate[matches['youtube_row'].to_numpy(dtype=np.int64)] = True
+    return duplicate
+
+def remove_duplicate_listens(spotify_df, youtube_df, tolerance=DUPLICATE_TOLERANCE, mode=DUPLICATE_MODE):
+    """
+    Drop (or flag) the youtube rows of listens that spotify logged as well, keeping the spotify
+    row since it knows the duration and skips
+    """
+    if spotify_df is None or youtube_df is None:
+        return spotify_df, youtube_df
 
-    merged_df = merged_df.sort_values("timestamp").reset_index(drop=True)
+    duplicate = find_duplicate_listens(spotify_df, youtube_df, tolerance)
+    print(f"  Found {int(duplicate.sum()):,} YouTube listens that Spotify also logged (within {tolerance.total_seconds():.0f}s)")
 
-    print(f"Merge Successful! Total records are now {len(merged_df):,}")
+    if mode == 'flag':
+        spotify_df['duplicate'] = False
+        youtube_df['duplicate'] = duplicate
+        return spotify_df, youtube_df
 
-    return merged_df
+    return spotify_df, youtube_df[~duplicate].reset_index(drop=True)
+
+def sort_if_needed(df):
+    """
+    Sort a source by timestamp, which costs nothing when it already is (the usual case)
+    """
+    if df['timestamp'].is_monotonic_increasing:
+        return df
+    return df.sort_values('timestamp', kind='stable')
 
-def add_columns(merged_df):
+def merge_order(timestamps):
     """
-    Add some extra columns that will be useful for the Wrapped analysis:
+    Row order that merges several already sorted timestamp columns into one sorted column.
+    numpy's stable sort is timsort, which finds the sorted runs and merges them in linear time
+    instead of sorting from scratch. Equal timestamps keep the order of the sources
     """
-    merged_df['date'] = merged_df['timestamp'].dt.date
-    merged_df['month'] = merged_df['timestamp'].dt.month
-    merged_df['month_name'] = merged_df['timestamp'].dt.month_name()
-    merged_df['day_of_week'] = merged_df['timestamp'].dt.day_name()
-    merged_df['hour'] = merged_df['timestamp'].dt.hour
-    merged_df['week_of_year'] = merged_df['timestamp'].dt.isocalendar().week
+    keys = np.concatenate([
+        column.dt.as_unit('ns').array.asi8 for column in timestamps
+    ])
+    return np.argsort(keys, kind='stable')
 
-    print("  Added: date, hour, day_of_week, month, month_name, week_of_year")
+def merge_datasets(*prepared_dfs):
+    """
+    Merge any number of prepared sources into one history sorted by timestamp
+    """
+    dfs_to_merge = [sort_if_needed(df) for df in prepared_dfs if df is not None]
+
+    if not dfs_to_merge:
+        print("No datasets to merge")
+        return None
     
+    # the cleaned names are categoricals, with shared categories concat keeps them as codes
+    share_categories(dfs_to_merge, ['track', 'artist', 'source', 'spotify_uri', 'video_id'])
+
+    order = merge_order([df['timestamp'] for df in dfs_to_merge])
+
+    merged_df = pd.concat(dfs_to_merge, ignore_index=True)
+    merged_df = merged_df.take(order).reset_index(drop=True)
+
+    print(f"Merge Successful! Total records are now {len(merged_df):,}")
+
     return merged_df
 
 def show_merge_summary(df):
     """
-    Show a nice summary of the merged data
+    Show a nice summary of the merged data, and hand back the stats for anything else that wants them
     """
-    print("\n" + "="*70)
-    print("MERGE SUMMARY")
-    print("="*70)
-    
-    
-    print("\n Records by Source:")
-    source_counts = df['source'].value_counts()
-    for source, count in source_counts.items():
-        percentage = (count / len(df)) * 100
-        print(f"  {source.capitalize()}: {count:,} ({percentage:.1f}%)")
-    
-    
-    print(f"\n Date Range:")
-    print(f"  First listen: {df['timestamp'].min()}")
-    print(f"  Last listen:  {df['timestamp'].max()}")
-    
-    
-    print(f"\n Unique Content:")
-    print(f"  Unique tracks:  {df['track'].nunique():,}")
-    print(f"  Unique artists: {df['artist'].nunique():,}")
-    
-    
-    print(f"\n Top 5 Most Played Tracks:")
-    top_tracks = df.groupby(['track', 'artist']).size().reset_index(name='plays')
-    top_tracks = top_tracks.sort_values('plays', ascending=False).head(5)
-    
-    for idx, row in top_tracks.iterrows():
-        print(f"  {row['plays']:3} plays - {row['track'].title()} by {row['artist'].title()}")
-    
-    
-    spotify_only = df[df['source'] == 'spotify'].copy()
-    if len(spotify_only) > 0 and 'skipped' in spotify_only.columns:
-        total_spotify = len(spotify_only)
-        skipped_count = spotify_only['skipped'].sum()
-        skip_rate = (skipped_count / total_spotify) * 100
-        print(f"\n Skip Statistics (Spotify only):")
-        print(f"  Total Spotify listens: {total_spotify:,}")
-        print(f"  Skipped: {int(skipped_count):,} ({skip_rate:.1f}%)")
-        print(f"  Completed: {total_spotify - int(skipped_count):,} ({100-skip_rate:.1f}%)")
-    
-    
-    print(f"\n Listens by Month:")
-    monthly = df.groupby('month_name').size()
-    
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June', 
-                   'July', 'August', 'September', 'October', 'November', 'December']
-    for month in month_order:
-        if month in monthly.index:
-            print(f"  {month}: {monthly[month]:,} listens")
-    
-    print("\n" + "="*70)
+    summary = summarize(df)
+    print_summary(summary)
+    return summary
+
+def save_merged_data(df, store_calendar=STORE_CALENDAR_COLUMNS):
+    if not store_calendar:
+        df = df.drop(columns=CALENDAR_COLUMNS, errors='ignore')
 
-def save_merged_data(df):
-    save_path = os.path.join(PROCESSED_DATA_FOLDER, "unified_music_history.parquet")
-    df.to_parquet(save_path, index=False)
+    df.to_parquet(UNIFIED_PATH, index=False)
 
-    print(f"Unified music history saved to {save_path}")
+    print(f"Unified music history saved to {UNIFIED_PATH}")
 
-    return save_path
+    return UNIFIED_PATH
 
-def run_merger():
+def run_merger(store_calendar=STORE_CALENDAR_COLUMNS):
     spotify_df, youtube_df = load_clean_data()
 
     spotify_prepared, youtube_prepared = prepare_for_merge(spotify_df, youtube_df)
 
+    spotify_prepared, youtube_prepared = match_tracks(spotify_prepared, youtube_prepared)
+
+    spotify_prepared, youtube_prepared = remove_duplicate_listens(spotify_prepared, youtube_prepared)
+
     merged_df = merge_datasets(spotify_prepared, youtube_prepared)
 
     merged_df = add_columns(merged_df)
 
     show_merge_summary(merged_df)
 
-    save_path = save_merged_data(merged_df)
+    save_path = save_merged_data(merged_df, store_calendar)
+
+    update_cube(merged_df)
 
     print("Merge Complete")
 
 if __name__ == "__main__":
-    run_merger()
\ No newline at end of file
+    run_merger()
@@ -0,0 +1,121 @@
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_FOLDER = os.path.join("data", "cache")
+
+# the most names one cache file keeps, the ones unused for the most runs go first
+MAX_ENTRIES = 250_000
+
+def rules_version(*rule_lists):
+    """
+    Short hash of the cleaning rules, any edit to them gives a new version (and a fresh cache)
+    """
+    text = json.dumps(rule_lists, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+class NameCache:
+    """
+    raw name -> cleaned name, kept on disk between runs and shared by every source.
+    There is one parquet file per kind of name and rules version
+    """
+
+    def __init__(self, kind, version, folder=CACHE_FOLDER, max_entries=MAX_ENTRIES):
+        self.kind = kind
+        self.version = version
+        self.folder = folder
+        self.max_entries = max_entries
+        self.path = os.path.join(folder, f"{kind}_names-{version}.parquet")
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.exists(self.path):
+            self.entries = pd.read_parquet(self.path).set_index('raw')
+        else:
+            self.entries = pd.DataFrame(
+                {'cleaned': pd.Series(dtype=object), 'last_used': pd.Series(dtype='int64')},
+                index=pd.Index([], dtype=object, name='raw'),
+            )
+
+        # every run gets a number, so we know which names haven't been seen for a while
+        self.run = int(self.entries['last_used'].max()) + 1 if len(self.entries) else 0
+
+    def clean(self, distinct, clean_column):
+        """
+        Cleaned names for a series of distinct raw names.
+        Only the names the cache hasn't seen before go through clean_column
+        """
+        distinct = pd.Series(distinct, dtype=object).reset_index(drop=True)
+        positions = self.entries.index.get_indexer(distinct)
+        found = positions >= 0
+
+        self.hits += int(found.sum())
+        self.misses += int((~found).sum())
+
+        cleaned = np.empty(len(distinct), dtype=object)
+        cleaned[found] = self.entries['cleaned'].to_numpy(dtype=object)[positions[found]]
+
+        self.mark_used(positions[found])
+
+        if not found.all():
+            new_names = distinct[~found]
+            new_cleaned = clean_column(new_names).to_numpy(dtype=object)
+            cleaned[~found] = new_cleaned
+            self.add(new_names, new_cleaned)
+
+        return pd.Series(cleaned, dtype=object)
+
+    def mark_used(self, positions):
+        """Set last_used of the entries at these positions to this run"""
+        if len(positions):
+            last_used = self.entries['last_used'].to_numpy(copy=True)
+            last_used[positions] = self.run
+            self.entries['last_used'] = last_used
+
+    def touch(self, raw):
+        """
+        Mark names that were used somewhere else (e.g. cache hits in a worker process)
+        as used in this run, so save doesn't evict them as if they were never looked up
+        """
+        positions = self.entries.index.get_indexer(pd.Index(np.asarray(raw, dtype=object), dtype=object))
+        self.mark_used(positions[positions >= 0])
+
+    def add(self, raw, cleaned):
+        new_entries = pd.DataFrame(
+            {'cleaned': np.asarray(cleaned, dtype=object), 'last_used': self.run},
+            index=pd.Index(np.asarray(raw, dtype=object), dtype=object, name='raw'),
+        )
+        self.entries = pd.concat([self.entries, new_entries])
+
+    def merge(self, entries):
+        """
+        Take in names cleaned somewhere else (e.g. by a worker process) that we don't have yet
+        """
+        new_entries = entries[~entries.index.isin(self.entries.index)]
+        new_entries = new_entries[~new_entries.index.duplicated()]
+        self.add(new_entries.index, new_entries['cleaned'])
+
+    def save(self):
+        """
+        Write the cache back, dropping the least recently used names when it is too big
+        and removing the files left behind by older versions of the rules
+        """
+        if len(self.entries) > self.max_entries:
+            self.entries = self.entries.sort_values('last_used', ascending=False, kind='stable').head(self.max_entries)
+
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        self.entries.reset_index().to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.path)
+
+        for old_path in glob.glob(os.path.join(self.folder, f"{self.kind}_names-*.parquet")):
+            if old_path != self.path:
+                os.remove(old_path)
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total) * 100 if total else 0
+        print(f"  {self.kind} name cache: {self.hits:,} hits, {self.misses:,} misses ({hit_rate:.1f}% hit rate), {len(self.entries):,} names stored")
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
+CUBE_FOLDER = os.path.join(PROCESSED_DATA_FOLDER, "wrapped_cube")
+STATE_PATH = os.path.join(CUBE_FOLDER, "_state.json")
+
+# one table of plays and listening time per group of dimensions, the rest of the
+# Wrapped questions (top artists of a month, plays per weekday, ...) are sums over these
+CUBOIDS = {
+    'tracks': ['year', 'month', 'source', 'artist', 'track'],
+    'time': ['year', 'month', 'source', 'day_of_week', 'hour'],
+}
+
+MEASURES = ['plays', 'duration_ms']
+
+# the columns the cuboids are built from. When any of them changes for listens that are already
+# in the cube (a fuzzy match picks another canonical name, the cleaning rules change, ...) it is rebuilt
+FINGERPRINT_COLUMNS = ['timestamp', 'source', 'artist', 'track', 'duration_ms']
+
+def cuboid_path(name):
+    return os.path.join(CUBE_FOLDER, f"{name}.parquet")
+
+def aggregate(df, dimensions):
+    """
+    Plays and summed duration_ms of the listens in df for every group of dimensions
+    """
+    grouped = df.assign(
+        year=df['timestamp'].dt.year.astype('int16'),
+        plays=1,
+        duration_ms=df['duration_ms'].fillna(0).astype('int64'),
+    ).groupby(dimensions, observed=True, sort=False)
+
+    return grouped[MEASURES].sum().reset_index()
+
+def combine(cuboid, new_rows, dimensions):
+    """
+    Add freshly aggregated rows into an existing cuboid
+    """
+    combined = pd.concat([cuboid, new_rows], ignore_index=True)
+    combined = combined.groupby(dimensions, observed=True, sort=False)[MEASURES].sum().reset_index()
+    return compact(combined)
+
+def compact(cuboid):
+    """Names as categoricals and counts as the smallest ints that fit"""
+    for column in ['source', 'artist', 'track', 'day_of_week']:
+        if column in cuboid.columns:
+            cuboid[column] = cuboid[column].astype('category')
+    for column in ['month', 'hour']:
+        if column in cuboid.columns:
+            cuboid[column] = cuboid[column].astype('int8')
+    cuboid['plays'] = pd.to_numeric(cuboid['plays'], downcast='integer')
+    return cuboid
+
+def row_hashes(df):
+    """One hash per listen of the columns the cube is built from"""
+    return pd.util.hash_pandas_object(df[FINGERPRINT_COLUMNS], index=False).to_numpy()
+
+def fingerprint(hashes):
+    """A short hash of a run of listens, in order"""
+    return hashlib.sha256(hashes.tobytes()).hexdigest()[:32]
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return None
+    with open(STATE_PATH, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_state(state):
+    temp_path = STATE_PATH + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, STATE_PATH)
+
+def load_cube():
+    """
+    The saved cuboids by name, or None when the cube hasn't been built yet
+    """
+    if load_state() is None:
+        return None
+    return {name: pd.read_parquet(cuboid_path(name)) for name in CUBOIDS}
+
+def update_cube(merged_df):
+    """
+    Bring the cube up to date with the merged history (which is sorted by timestamp).
+    Only listens after the watermark, the newest timestamp already in the cube, get aggregated.
+    When the older part of the history changed too (an export from further back was added,
+    or listens already in the cube were relabelled) the cube is rebuilt from scratch
+    """
+    os.makedirs(CUBE_FOLDER, exist_ok=True)
+
+    state = load_state()
+    cube = load_cube()
+    timestamps = merged_df['timestamp']
+    hashes = row_hashes(merged_df)
+
+    new_start = 0
+    if state is not None and cube is not None:
+        watermark = pd.Timestamp(state['watermark'])
+        new_start = int(timestamps.searchsorted(watermark, side='right'))
+
+        if new_start != state['listens'] or fingerprint(hashes[:new_start]) != state.get('fingerprint'):
+            print(f"  History up to {watermark} changed, rebuilding the cube")
+            cube = None
+            new_start = 0
+
+    new_listens = merged_df.iloc[new_start:]
+
+    for name, dimensions in CUBOIDS.items():
+        new_rows = aggregate(new_listens, dimensions)
+        if cube is None:
+            cuboid = compact(new_rows)
+        else:
+            cuboid = combine(cube[name], new_rows, dimensions)
+        cuboid.to_parquet(cuboid_path(name), index=False)
+
+    if len(merged_df):
+        save_state({
+            'watermark': timestamps.iloc[-1].isoformat(),
+            'listens': len(merged_df),
+            'fingerprint': fingerprint(hashes),
+        })
+
+    print(f"  Wrapped cube: {len(new_listens):,} new listens added ({len(merged_df):,} total)")
+
+    return load_cube()
+
+def filter_cuboid(cuboid, filters):
+    for column, value in filters.items():
+        cuboid = cuboid[cuboid[column] == value]
+    return cuboid
+
+def breakdown(cube, dimension, **filters):
+    """
+    Plays and listening time by one dimension, e.g. breakdown(cube, 'hour', year=2025)
+    """
+    name = 'tracks' if dimension in CUBOIDS['tracks'] and all(column in CUBOIDS['tracks'] for column in filters) else 'time'
+    cuboid = filter_cuboid(cube[name], filters)
+    return cuboid.groupby(dimension, observed=True)[MEASURES].sum()
+
+def top_tracks(cube, n=5, **filters):
+    """The n most played (track, artist) pairs, e.g. top_tracks(cube, 5, year=2025, month=3)"""
+    cuboid = filter_cuboid(cube['tracks'], filters)
+    plays = cuboid.groupby(['track', 'artist'], observed=True)[MEASURES].sum()
+    return plays.sort_values('plays', ascending=False, kind='stable').head(n).reset_index()
+
+def top_artists(cube, n=5, **filters):
+    """The n most played artists, e.g. top_artists(cube, 5, source='spotify')"""
+    cuboid = filter_cuboid(cube['tracks'], filters)
+    plays = cuboid.groupby('artist', observed=True)[MEASURES].sum()
+    return plays.sort_values('plays', ascending=False, kind='stable').head(n).reset_index()
@@ -0,0 +1,156 @@
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+
+from unified_history import MONTH_NAMES
+
+TOP_N = 5
+
+@dataclass
+class WrappedSummary:
+    """
+    The Wrapped stats of a listening history, worked out once and shared by
+    the merge summary, the notebooks and anything else that wants them
+    """
+    total_listens: int
+    listens_by_source: dict
+    first_listen: pd.Timestamp
+    last_listen: pd.Timestamp
+    unique_tracks: int
+    unique_artists: int
+    top_tracks: list = field(default_factory=list)  # (track, artist, plays), most played first
+    spotify_listens: int = 0
+    spotify_skipped: int = 0
+    listens_by_month: dict = field(default_factory=dict)  # month name -> listens, calendar order
+
+    @property
+    def skip_rate(self):
+        return (self.spotify_skipped / self.spotify_listens) * 100 if self.spotify_listens else 0
+
+def column_codes(column):
+    """
+    Integer codes and the values they stand for, -1 for missing values.
+    Categorical columns (the cleaned names, the source) already have them
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, uniques = pd.factorize(column)
+    return codes, pd.Index(uniques)
+
+def count_codes(codes, length):
+    """How often every code shows up, ignoring the missing ones"""
+    return np.bincount(codes[codes >= 0], minlength=length)
+
+def top_pairs(track_codes, artist_codes, artist_count, top_n):
+    """
+    The most played (track code, artist code) pairs with their plays.
+    Each pair becomes one int64 key, so this is a count over integers rather than a groupby
+    """
+    present = (track_codes >= 0) & (artist_codes >= 0)
+    keys = track_codes[present].astype(np.int64) * artist_count + artist_codes[present]
+
+    pair_keys, plays = np.unique(keys, return_counts=True)
+    top = np.argsort(-plays, kind='stable')[:top_n]
+
+    return pair_keys[top] // artist_count, pair_keys[top] % artist_count, plays[top]
+
+def summarize(df, top_n=TOP_N):
+    """
+    Work out every Wrapped summary stat from the integer codes of the merged history
+    """
+    track_codes, tracks = column_codes(df['track'])
+    artist_codes, artists = column_codes(df['artist'])
+    source_codes, sources = column_codes(df['source'])
+
+    source_counts = count_codes(source_codes, len(sources))
+    track_counts = count_codes(track_codes, len(tracks))
+    artist_counts = count_codes(artist_codes, len(artists))
+
+    if 'month' in df.columns:
+        months = df['month'].to_numpy(dtype=np.int64)
+    else:
+        months = df['timestamp'].dt.month.to_numpy(dtype=np.int64)
+    month_counts = np.bincount(months - 1, minlength=12)
+
+    timestamps = df['timestamp']
+    first_listen = timestamps.min() if len(df) else None
+    last_listen = timestamps.max() if len(df) else None
+
+    top_tracks = [
+        (tracks[track], artists[artist], int(plays))
+        for track, artist, plays in zip(*top_pairs(track_codes, artist_codes, max(len(artists), 1), top_n))
+    ]
+
+    # skips only exist for spotify, missing ones count as not skipped
+    spotify_listens = 0
+    spotify_skipped = 0
+    if 'spotify' in sources:
+        spotify = source_codes == sources.get_loc('spotify')
+        spotify_listens = int(spotify.sum())
+        if 'skipped' in df.columns:
+            skipped = df['skipped'].to_numpy(dtype=bool, na_value=False)
+            spotify_skipped = int((skipped & spotify).sum())
+
+    return WrappedSummary(
+        total_listens=len(df),
+        listens_by_source={
+            source: int(count)
+            for source, count in sorted(zip(sources, source_counts), key=lambda item: -item[1])
+            if count
+        },
+        first_listen=first_listen,
+        last_listen=last_listen,
+        unique_tracks=int(np.count_nonzero(track_counts)),
+        unique_artists=int(np.count_nonzero(artist_counts)),
+        top_tracks=top_tracks,
+        spotify_listens=spotify_listens,
+        spotify_skipped=spotify_skipped,
+        listens_by_month={
+            month: int(count)
+            for month, count in zip(MONTH_NAMES, month_counts)
+            if count
+        },
+    )
+
+def print_summary(summary):
+    """
+    Show a nice summary of the merged data
+    """
+    print("\n" + "="*70)
+    print("MERGE SUMMARY")
+    print("="*70)
+
+
+    print("\n Records by Source:")
+    for source, count in summary.listens_by_source.items():
+        percentage = (count / summary.total_listens) * 100
+        print(f"  {source.capitalize()}: {count:,} ({percentage:.1f}%)")
+
+
+    print(f"\n Date Range:")
+    print(f"  First listen: {summary.first_listen}")
+    print(f"  Last listen:  {summary.last_listen}")
+
+
+    print(f"\n Unique Content:")
+    print(f"  Unique tracks:  {summary.unique_tracks:,}")
+    print(f"  Unique artists: {summary.unique_artists:,}")
+
+
+    print(f"\n Top {len(summary.top_tracks)} Most Played Tracks:")
+    for track, artist, plays in summary.top_tracks:
+        print(f"  {plays:3} plays - {track.title()} by {artist.title()}")
+
+
+    if summary.spotify_listens > 0:
+        print(f"\n Skip Statistics (Spotify only):")
+        print(f"  Total Spotify listens: {summary.spotify_listens:,}")
+        print(f"  Skipped: {summary.spotify_skipped:,} ({summary.skip_rate:.1f}%)")
+        print(f"  Completed: {summary.spotify_listens - summary.spotify_skipped:,} ({100-summary.skip_rate:.1f}%)")
+
+
+    print(f"\n Listens by Month:")
+    for month, count in summary.listens_by_month.items():
+        print(f"  {month}: {count:,} listens")
+
+    print("\n" + "="*70)
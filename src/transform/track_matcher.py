@@ -0,0 +1,247 @@
+import re
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process, utils
+
+# how alike two names have to be (0-100) to count as the same artist or track
+ARTIST_THRESHOLD = 92
+TRACK_THRESHOLD = 90
+
+# in short titles one letter is already a different song ("love story" / "love storm" score 90),
+# so titles shorter than this have to be nearly identical
+SHORT_TITLE_LENGTH = 16
+SHORT_TITLE_THRESHOLD = 97
+# the same goes for short artist names ("future" / "futures", "the weeknd" / "the weekend")
+SHORT_ARTIST_THRESHOLD = 97
+
+# blocks bigger than this get split further by the start of the name, so cdist never builds huge matrices
+MAX_BLOCK_SIZE = 2_000
+PREFIX_LENGTH = 2
+
+# names that only say we don't know, these never get merged into anything
+UNMATCHED_ARTISTS = {"unknown"}
+
+DIGITS = re.compile(r"\d+")
+
+# roman numerals and number words count as numbers too, so "part ii" and "part 2" are the same part
+ROMAN_NUMERALS = {
+    'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6,
+    'vii': 7, 'viii': 8, 'ix': 9, 'x': 10, 'xi': 11, 'xii': 12,
+}
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+}
+# words before the number of a part, the number words only count after one of these
+PART_WORDS = {'part', 'pt', 'vol', 'volume', 'chapter', 'act'}
+# also plain words ("i", "a x b"), so they only count after a part word or at the end of a name
+AMBIGUOUS_NUMERALS = {'i', 'v', 'x'}
+
+# a valid spotify track uri, two keys with different ones are different recordings
+SPOTIFY_TRACK_URI = re.compile(r"spotify:track:[A-Za-z0-9]{22}")
+
+class UnionFind:
+    """
+    Groups of positions that were found to be the same thing.
+    Positions can carry a label (-1 for none), and two groups with different labels are never joined
+    """
+
+    def __init__(self, size, labels=None):
+        self.parent = np.arange(size)
+        self.labels = np.full(size, -1) if labels is None else np.array(labels)
+
+    def find(self, position):
+        root = position
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[position] != root:
+            self.parent[position], position = root, self.parent[position]
+        return root
+
+    def union(self, first, second):
+        first_root, second_root = self.find(first), self.find(second)
+        if first_root == second_root:
+            return
+
+        first_label, second_label = self.labels[first_root], self.labels[second_root]
+        if first_label >= 0 and second_label >= 0 and first_label != second_label:
+            return
+
+        root = min(first_root, second_root)
+        self.parent[max(first_root, second_root)] = root
+        self.labels[root] = max(first_label, second_label)
+
+    def groups(self):
+        return np.array([self.find(position) for position in range(len(self.parent))])
+
+def name_numbers(processed):
+    """
+    The numbers in a processed name: digits, roman numerals and, after a part word, number words
+    """
+    words = processed.split()
+    numbers = []
+    for position, word in enumerate(words):
+        after_part = position > 0 and words[position - 1] in PART_WORDS
+        at_end = position == len(words) - 1
+
+        if DIGITS.search(word):
+            numbers.extend(str(int(digits)) for digits in DIGITS.findall(word))
+        elif word in ROMAN_NUMERALS and (word not in AMBIGUOUS_NUMERALS or after_part or at_end):
+            numbers.append(str(ROMAN_NUMERALS[word]))
+        elif word in NUMBER_WORDS and after_part:
+            numbers.append(str(NUMBER_WORDS[word]))
+    return " ".join(numbers)
+
+def block_key(name, prefix=True):
+    """
+    Names can only match inside the same block: same numbers (so "song 1" never becomes "song 2",
+    nor "interlude i" "interlude ii") and, for big blocks, the same first letters
+    """
+    processed = utils.default_process(name)
+    return (processed[:PREFIX_LENGTH] if prefix else "", name_numbers(processed))
+
+def block_matches(names, threshold, short_threshold=None):
+    """
+    Pairs of positions in names that score above the threshold, scored a whole block at a time.
+    With short_threshold, pairs where either name is shorter than SHORT_TITLE_LENGTH need that instead
+    """
+    if len(names) < 2:
+        return []
+
+    scores = process.cdist(
+        names, names,
+        scorer=fuzz.token_sort_ratio,
+        processor=utils.default_process,
+        score_cutoff=threshold,
+        dtype=np.uint8,
+        workers=-1,
+    )
+    first, second = np.nonzero(np.triu(scores, k=1))
+
+    if short_threshold is not None and len(first):
+        lengths = np.array([len(utils.default_process(name)) for name in names])
+        short = np.minimum(lengths[first], lengths[second]) < SHORT_TITLE_LENGTH
+        kept = ~short | (scores[first, second] >= short_threshold)
+        first, second = first[kept], second[kept]
+
+    return list(zip(first, second))
+
+def group_positions(positions, keys):
+    """Positions that share a key, by key"""
+    grouped = {}
+    for position, key in zip(positions, keys):
+        grouped.setdefault(key, []).append(position)
+    return grouped
+
+def find_groups(names, plays, blocks, threshold, short_threshold=None, labels=None):
+    """
+    Canonical position for every name: names that match (directly or through each other)
+    inside a block form a group, and the most played name of the group stands for all of them.
+    Names with different labels (e.g. spotify ids) never end up in the same group
+    """
+    union_find = UnionFind(len(names), labels)
+
+    for positions in group_positions(range(len(names)), blocks).values():
+        # split oversized blocks by the first letters as well
+        if len(positions) > MAX_BLOCK_SIZE:
+            prefixes = [block_key(names[position])[0] for position in positions]
+            position_sets = group_positions(positions, prefixes).values()
+        else:
+            position_sets = [positions]
+
+        for block in position_sets:
+            for first, second in block_matches([names[position] for position in block], threshold, short_threshold):
+                union_find.union(block[first], block[second])
+
+    groups = union_find.groups()
+
+    # most played first, then shortest name, then alphabetical
+    order = sorted(range(len(names)), key=lambda position: (-plays[position], len(names[position]), names[position]))
+    canonical = {}
+    for position in order:
+        canonical.setdefault(groups[position], position)
+
+    return np.array([canonical[group] for group in groups])
+
+def resolve_keys(dfs):
+    """
+    Rewrite near-duplicate (track, artist) keys to one canonical key in every dataframe.
+    The track and artist columns have to be categoricals with the same categories in every
+    dataframe (see merger.share_categories); the rows only have their codes swapped
+    """
+    tracks = dfs[0]['track'].cat.categories
+    artists = dfs[0]['artist'].cat.categories
+
+    track_codes = np.concatenate([df['track'].cat.codes.to_numpy(dtype=np.int64) for df in dfs])
+    artist_codes = np.concatenate([df['artist'].cat.codes.to_numpy(dtype=np.int64) for df in dfs])
+
+    present = (track_codes >= 0) & (artist_codes >= 0)
+    pair_keys = track_codes * len(artists) + artist_codes
+    distinct_keys, plays = np.unique(pair_keys[present], return_counts=True)
+    if not len(distinct_keys):
+        return dfs
+
+    pair_tracks = distinct_keys // len(artists)
+    pair_artists = distinct_keys % len(artists)
+
+    # position of every row's key among the distinct keys
+    positions = np.searchsorted(distinct_keys, pair_keys)
+    positions[~present] = 0
+
+    # the spotify uri each key was played with, if any, as a label that keeps different recordings apart
+    pair_uris = np.full(len(distinct_keys), -1)
+    # spotify spells every artist one way, so two names that both come with a spotify uri are two artists
+    artist_labels = np.full(len(artists), -1)
+    if all('spotify_uri' in df.columns and isinstance(df['spotify_uri'].dtype, pd.CategoricalDtype) for df in dfs):
+        uris = dfs[0]['spotify_uri'].cat.categories
+        valid_uris = np.append(np.array([bool(SPOTIFY_TRACK_URI.fullmatch(str(uri))) for uri in uris], dtype=bool), False)
+        uri_codes = np.concatenate([df['spotify_uri'].cat.codes.to_numpy(dtype=np.int64) for df in dfs])
+        with_uri = present & valid_uris[uri_codes]
+        pair_uris[positions[with_uri]] = uri_codes[with_uri]
+        spotify_artists = np.unique(artist_codes[with_uri])
+        artist_labels[spotify_artists] = spotify_artists
+
+    # artists first, blocked by how their names start and the numbers in them
+    artist_plays = np.bincount(pair_artists, weights=plays, minlength=len(artists))
+    artist_names = list(artists)
+    artist_blocks = [
+        (position,) if name in UNMATCHED_ARTISTS else block_key(name)
+        for position, name in enumerate(artist_names)
+    ]
+    canonical_artists = find_groups(
+        artist_names, artist_plays, artist_blocks, ARTIST_THRESHOLD, SHORT_ARTIST_THRESHOLD, artist_labels
+    )
+    pair_artists = canonical_artists[pair_artists]
+
+    # then the tracks of each (canonical) artist, blocked by the numbers in their titles
+    track_names = [tracks[code] for code in pair_tracks]
+    track_blocks = [
+        (artist, position) if artist_names[artist] in UNMATCHED_ARTISTS else (artist,) + block_key(name, prefix=False)
+        for position, (name, artist) in enumerate(zip(track_names, pair_artists))
+    ]
+    canonical_pairs = find_groups(track_names, plays, track_blocks, TRACK_THRESHOLD, SHORT_TITLE_THRESHOLD, pair_uris)
+
+    new_track_codes = pair_tracks[canonical_pairs]
+    new_artist_codes = pair_artists[canonical_pairs]
+    merged_keys = int(np.count_nonzero(
+        (new_track_codes != pair_tracks) | (new_artist_codes != distinct_keys % len(artists))
+    ))
+
+    # map every row to its canonical pair through its position among the distinct keys
+    start = 0
+    for df in dfs:
+        end = start + len(df)
+        row_positions = positions[start:end]
+        row_present = present[start:end]
+
+        df['track'] = pd.Categorical.from_codes(
+            np.where(row_present, new_track_codes[row_positions], track_codes[start:end]), categories=tracks
+        )
+        df['artist'] = pd.Categorical.from_codes(
+            np.where(row_present, new_artist_codes[row_positions], artist_codes[start:end]), categories=artists
+        )
+        start = end
+
+    print(f"  Fuzzy matching: {merged_keys:,} of {len(distinct_keys):,} (track, artist) keys merged into near-identical ones")
+
+    return dfs
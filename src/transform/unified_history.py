@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pandas as pd
+
+# how the unified history is stored and read back, shared by the merger and the enricher.
+# only numpy and pandas, so the enricher can use it without pulling in the rest of the merger
+
+PROCESSED_DATA_FOLDER = os.path.join("data", "processed")
+UNIFIED_PATH = os.path.join(PROCESSED_DATA_FOLDER, "unified_music_history.parquet")
+
+CALENDAR_COLUMNS = ['date', 'month', 'month_name', 'day_of_week', 'hour', 'week_of_year']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+NS_PER_HOUR = 3_600 * 10**9
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+def calendar_columns(timestamps):
+    """
+    date, month, month_name, day_of_week, hour and week_of_year for a column of UTC timestamps,
+    worked out with integer arithmetic on the raw nanoseconds. Names and dates are categoricals
+    and the numbers are int8, so no python objects get made per listen
+    """
+    ns = timestamps.dt.as_unit('ns').array.asi8
+    days = ns // NS_PER_DAY
+    day_of_week = (days + 3) % 7  # 1970-01-01 was a thursday, monday is 0
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12
+
+    # the iso week is the week of its thursday, counted from the start of that thursday's year
+    thursdays = (days - day_of_week + 3).astype('datetime64[D]')
+    year_starts = thursdays.astype('datetime64[Y]').astype('datetime64[D]')
+    week_of_year = (thursdays - year_starts).astype(np.int64) // 7 + 1
+
+    listening_days, date_codes = np.unique(days, return_inverse=True)
+
+    return {
+        'date': pd.Categorical.from_codes(date_codes, categories=pd.DatetimeIndex(listening_days.astype('datetime64[D]'))),
+        'month': (months + 1).astype(np.int8),
+        'month_name': pd.Categorical.from_codes(months, categories=MONTH_NAMES, ordered=True),
+        'day_of_week': pd.Categorical.from_codes(day_of_week, categories=DAY_NAMES, ordered=True),
+        'hour': (ns // NS_PER_HOUR % 24).astype(np.int8),
+        'week_of_year': week_of_year.astype(np.int8),
+    }
+
+def add_columns(merged_df):
+    """
+    Add some extra columns that will be useful for the Wrapped analysis:
+    """
+    for column, values in calendar_columns(merged_df['timestamp']).items():
+        merged_df[column] = values
+
+    print("  Added: date, hour, day_of_week, month, month_name, week_of_year")
+    
+    return merged_df
+
+def load_unified_history(path=UNIFIED_PATH):
+    """
+    Read the unified history, adding the calendar columns when they weren't saved with it
+    """
+    df = pd.read_parquet(path)
+    if not set(CALENDAR_COLUMNS).issubset(df.columns):
+        df = add_columns(df)
+    return df
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "transform"))
+
+from cleaner import THINGS_TO_REMOVE, ARTIST_REMOVALS
+
+# made up history names, shared by the cleaner tests and src/benchmark_cleaner.py
+
+WORDS = ["love", "Night", "BABY", "go", "Dance", "fire", "-", ".", "_", ",", "  ", "\t", "Topic", "VEVO", "Official"]
+
+def random_name(rng):
+    """A made up messy title or channel name built from real words and markers"""
+    parts = [rng.choice(WORDS) for _ in range(rng.randint(0, 5))]
+    if rng.random() < 0.5:
+        parts.insert(rng.randint(0, len(parts)), rng.choice(THINGS_TO_REMOVE + ARTIST_REMOVALS))
+    return " ".join(parts) if rng.random() < 0.8 else "".join(parts)
@@ -0,0 +1,81 @@
+import os
+import sys
+import importlib
+import pandas as pd
+import pytest
+from spotipy.exceptions import SpotifyException
+
+# the scripts under src import each other by file name
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.insert(0, os.path.join(SRC_FOLDER, "enrich"))
+sys.path.insert(0, SRC_FOLDER)
+
+from benchmark_enricher import fake_id, fake_track
+
+class FakeSpotify:
+    """Knows every track, has features for the even ones only, or answers 403 for all of them"""
+
+    def __init__(self, refuse_features=False):
+        self.refuse_features = refuse_features
+        self.features_asked = []
+
+    def tracks(self, ids):
+        return {'tracks': [fake_track(track_id) for track_id in ids]}
+
+    def artists(self, ids):
+        return {'artists': [{'id': artist_id, 'genres': ["pop"]} for artist_id in ids]}
+
+    def audio_features(self, ids):
+        self.features_asked.extend(ids)
+        if self.refuse_features:
+            raise SpotifyException(403, -1, "forbidden")
+        return [
+            {'id': track_id, 'energy': 0.5, 'valence': 0.5, 'danceability': 0.5, 'tempo': 120.0}
+            if int(track_id, 16) % 2 == 0 else None
+            for track_id in ids
+        ]
+
+@pytest.fixture
+def enricher(monkeypatch):
+    # the enricher makes its client on import
+    monkeypatch.setenv("SPOTIFY_ACCESS_TOKEN", "fake")
+    return importlib.import_module("spotify_enricher")
+
+def known_tracks(names):
+    return pd.DataFrame({
+        'track': names,
+        'artist': "artist",
+        'play_count': 1,
+        'spotify_id': [fake_id(name) for name in names],
+    })
+
+def enrich(enricher, monkeypatch, spotify, tracks, cache_path):
+    monkeypatch.setattr(enricher, "sp", spotify)
+    return enricher.enrich_tracks_optimized(tracks, workers=2, cache_path=cache_path)
+
+def test_tracks_without_features_are_cached(enricher, monkeypatch, tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    tracks = known_tracks([f"song {number}" for number in range(20)])
+
+    first = FakeSpotify()
+    enriched = enrich(enricher, monkeypatch, first, tracks, cache_path)
+    assert sorted(first.features_asked) == sorted(tracks['spotify_id'])
+    assert enriched['energy'].notna().tolist() == [int(track_id, 16) % 2 == 0 for track_id in tracks['spotify_id']]
+
+    second = FakeSpotify()
+    enriched_again = enrich(enricher, monkeypatch, second, tracks, cache_path)
+    assert second.features_asked == []
+    assert enriched_again['energy'].notna().tolist() == enriched['energy'].notna().tolist()
+
+def test_refused_features_are_not_asked_again(enricher, monkeypatch, tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+
+    refusing = FakeSpotify(refuse_features=True)
+    enriched = enrich(enricher, monkeypatch, refusing, known_tracks(["song 1", "song 2"]), cache_path)
+    assert refusing.features_asked
+    assert 'energy' not in enriched.columns or enriched['energy'].isna().all()
+
+    # not for the same tracks, nor for new ones, until the refusal expires
+    later = FakeSpotify()
+    enrich(enricher, monkeypatch, later, known_tracks(["song 1", "song 2", "song 3"]), cache_path)
+    assert later.features_asked == []
@@ -0,0 +1,68 @@
+import os
+import sys
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "transform"))
+
+from cleaner import (
+    clean_track_name, clean_artist_name, clean_track_names, clean_artist_names, clean_distinct,
+)
+from name_generator import random_name
+
+# the column cleaners (and cleaning only the distinct names) have to give exactly
+# what the row by row cleaners give
+
+RANDOM_NAMES = 100_000
+
+# names that have tripped up the cleaning before, plus the usual youtube mess
+EDGE_CASES = [
+    None, np.nan, "", " ", "   ", "-", "._-", "(feat. someone)", "[", "[lyrics]",
+    "Song (feat. X)", "Song (ft. X) [Official Video]", "Song ft X", "Song ft. X", "Song feat X",
+    "Song (Official Video)", "Song (official video)", "Song  \t (lyric video)", "Song  Name",
+    "  Song Name - ", "Song_-.", "song (with friends) (remix)", "Song [official audio] (lyrics)",
+    "Artist - Topic", "ArtistVEVO", "artistvevo", "Artist Official", "Artist, Other Artist",
+    "official", "vevo - topic", "A - Topic, B", "Ärtist Topic", "İstanbul", "ß", "vevevoo",
+]
+
+CLEANERS = [
+    pytest.param(clean_track_name, clean_track_names, id="track"),
+    pytest.param(clean_artist_name, clean_artist_names, id="artist"),
+]
+
+def differences(values, clean_name, cleaned):
+    """The (value, expected, cleaned) rows where a column cleaner disagrees with the row cleaner"""
+    return [
+        (value, clean_name(value), name)
+        for value, name in zip(values, cleaned)
+        if clean_name(value) != name
+    ]
+
+@pytest.fixture(scope="module")
+def random_names():
+    rng = random.Random(1)
+    return [random_name(rng) for _ in range(RANDOM_NAMES)]
+
+@pytest.mark.parametrize("clean_name, clean_column", CLEANERS)
+@pytest.mark.parametrize("value", EDGE_CASES)
+def test_edge_case(value, clean_name, clean_column):
+    assert clean_column(pd.Series([value], dtype=object)).tolist() == [clean_name(value)]
+
+@pytest.mark.parametrize("clean_name, clean_column", CLEANERS)
+def test_edge_cases_together(clean_name, clean_column):
+    cleaned = clean_column(pd.Series(EDGE_CASES, dtype=object)).tolist()
+    assert differences(EDGE_CASES, clean_name, cleaned) == []
+
+@pytest.mark.parametrize("clean_name, clean_column", CLEANERS)
+def test_random_names(random_names, clean_name, clean_column):
+    cleaned = clean_column(pd.Series(random_names, dtype=object)).tolist()
+    assert differences(random_names, clean_name, cleaned) == []
+
+@pytest.mark.parametrize("clean_name, clean_column", CLEANERS)
+def test_clean_distinct(random_names, clean_name, clean_column):
+    values = EDGE_CASES + random_names
+    cleaned = clean_distinct(pd.Series(values, dtype=object), clean_column).astype(object).tolist()
+    assert differences(values, clean_name, cleaned) == []
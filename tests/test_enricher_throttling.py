@@ -0,0 +1,67 @@
+import os
+import sys
+import hashlib
+import importlib
+import pytest
+import pandas as pd
+
+# the scripts under src import each other by file name
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.insert(0, os.path.join(SRC_FOLDER, "enrich"))
+sys.path.insert(0, SRC_FOLDER)
+
+import benchmark_enricher
+
+TRACKS = 60
+SERVER_RATE = 5  # low enough that the stand-in answers some requests with 429
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    monkeypatch.setattr(benchmark_enricher, "SERVER_RATE", SERVER_RATE)
+    server = benchmark_enricher.start_server()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def enricher(stand_in, monkeypatch):
+    """the enricher pointed at the stand-in, allowing twice what the stand-in does"""
+    # the enricher makes its client on import
+    prefix = f"http://127.0.0.1:{stand_in.server_port}/v1/"
+    monkeypatch.setenv("SPOTIFY_API_PREFIX", prefix)
+    monkeypatch.setenv("SPOTIFY_ACCESS_TOKEN", "stand-in")
+    spotify_enricher = importlib.import_module("spotify_enricher")
+
+    monkeypatch.setattr(spotify_enricher, "sp", spotify_enricher.get_spotify_client(prefix, "stand-in"))
+    rate_limiter = spotify_enricher.TokenBucket(rate=SERVER_RATE * 2, burst=SERVER_RATE * 2)
+    monkeypatch.setattr(spotify_enricher, "rate_limiter", rate_limiter)
+
+    # remember every pause the 429s asked for
+    rate_limiter.pauses = []
+    pause = rate_limiter.pause
+    def recording_pause(seconds):
+        rate_limiter.pauses.append(seconds)
+        pause(seconds)
+    rate_limiter.pause = recording_pause
+
+    return spotify_enricher
+
+def found_by_search(spotify_enricher, track, artist):
+    """whether the stand-in finds the search for a track, the same way it decides"""
+    query = f"track:{track} artist:{spotify_enricher.clean_artist_for_search(artist)}"
+    return int(hashlib.md5(query.encode()).hexdigest(), 16) % 3 != 0
+
+def test_throttled_enrichment_resolves_every_track(enricher, stand_in, tmp_path):
+    tracks = benchmark_enricher.unique_tracks(TRACKS)
+
+    enriched = enricher.enrich_tracks_optimized(tracks, workers=4, cache_path=str(tmp_path / "cache.sqlite"))
+
+    assert stand_in.throttled > 0
+    assert enricher.rate_limiter.pauses
+    assert set(enricher.rate_limiter.pauses) == {float(benchmark_enricher.RETRY_AFTER)}
+
+    expected = [
+        pd.notna(spotify_id) or found_by_search(enricher, track, artist)
+        for track, artist, spotify_id in zip(tracks['track'], tracks['artist'], tracks['spotify_id'])
+    ]
+    assert enriched['spotify_id'].notna().tolist() == expected
+    assert enriched['energy'].notna().tolist() == expected
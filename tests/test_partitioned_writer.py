@@ -0,0 +1,37 @@
+import os
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "extract"))
+
+from partitioned_writer import PartitionedWriter
+
+ROWS = 1_500
+BATCH_SIZE = 100
+
+def listens(start, count):
+    """count listens spread over three months, in batches that mix the months"""
+    months = [f"2025-0{1 + number % 3}-01T00:00:00Z" for number in range(start, start + count)]
+    return pa.table({
+        'timestamp': pa.array(months, pa.string()).cast(pa.timestamp('ns', tz='UTC')),
+        'number': pa.array(range(start, start + count), pa.int64()),
+    })
+
+def test_buffered_rows_stay_under_the_cap(tmp_path):
+    writer = PartitionedWriter(str(tmp_path), "spotify", "part.parquet", max_buffered_rows=BATCH_SIZE)
+
+    most_buffered = 0
+    for start in range(0, ROWS, BATCH_SIZE):
+        writer.write(listens(start, BATCH_SIZE))
+        most_buffered = max(most_buffered, sum(writer.buffered_rows.values()))
+    parts = writer.close()
+
+    assert most_buffered <= BATCH_SIZE
+    assert len(parts) == 3
+
+    # every row is written once, in its own month's file
+    tables = [pq.read_table(os.path.join(tmp_path, part)) for part in parts]
+    numbers = sorted(number for table in tables for number in table['number'].to_pylist())
+    assert numbers == list(range(ROWS))
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import zipfile
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "extract"))
+
+import youtube_loader
+from manifest import load_manifest, dataset_row_count
+from raw_sources import RawFile, ZipMember, find_raw_sources
+
+MEMBER_NAME = "Takeout/YouTube and YouTube Music/history/watch-history.json"
+
+def watch_history(days):
+    """a watch history with one YouTube Music listen on each of the first days of january 2025"""
+    return json.dumps([
+        {
+            'header': "YouTube Music",
+            'title': f"Watched Song {day}",
+            'titleUrl': f"https://music.youtube.com/watch?v=video{day:06d}",
+            'subtitles': [{'name': "Artist - Topic"}],
+            'time': f"2025-01-{day:02d}T12:00:00Z",
+        }
+        for day in range(1, days + 1)
+    ])
+
+def write_takeout(path, days, mtime):
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr(MEMBER_NAME, watch_history(days))
+    os.utime(path, (mtime, mtime))
+
+def ingest(raw_folder, listens_folder, monkeypatch):
+    """run the youtube loader on raw_folder and return the number of rows in the dataset"""
+    manifest_path = os.path.join(listens_folder, "_youtube_manifest.json")
+    monkeypatch.setattr(youtube_loader, "RAW_DATA_FOLDER", raw_folder)
+    monkeypatch.setattr(youtube_loader, "LISTENS_FOLDER", listens_folder)
+    monkeypatch.setattr(youtube_loader, "MANIFEST_PATH", manifest_path)
+    youtube_loader.load_youtube_data()
+    return dataset_row_count(load_manifest(manifest_path), listens_folder)
+
+def test_unpacked_file_wins_over_its_zipped_copy(tmp_path):
+    write_takeout(tmp_path / "takeout-001.zip", 10, 1_000_000)
+    (tmp_path / "watch-history.json").write_text(watch_history(10), encoding='utf-8')
+
+    sources = find_raw_sources(str(tmp_path), lambda filename: filename == "watch-history.json")
+
+    assert len(sources) == 1
+    assert isinstance(sources[0], RawFile)
+
+def test_newest_archive_wins(tmp_path):
+    write_takeout(tmp_path / "takeout-new.zip", 10, 2_000_000)
+    write_takeout(tmp_path / "takeout-old.zip", 5, 1_000_000)
+
+    sources = find_raw_sources(str(tmp_path), lambda filename: filename == "watch-history.json")
+
+    assert len(sources) == 1
+    assert isinstance(sources[0], ZipMember)
+    assert sources[0].archive_path.endswith("takeout-new.zip")
+
+def test_unpacking_an_ingested_archive_adds_nothing(tmp_path, monkeypatch):
+    raw_folder, listens_folder = tmp_path / "raw", tmp_path / "listens"
+    raw_folder.mkdir()
+    write_takeout(raw_folder / "takeout-001.zip", 10, 1_000_000)
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 10
+
+    (raw_folder / "watch-history.json").write_text(watch_history(10), encoding='utf-8')
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 10
+
+def test_newer_takeout_replaces_the_older_one(tmp_path, monkeypatch):
+    raw_folder, listens_folder = tmp_path / "raw", tmp_path / "listens"
+    raw_folder.mkdir()
+    write_takeout(raw_folder / "takeout-2025-01-05.zip", 5, 1_000_000)
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 5
+
+    # the newer export holds the whole history again, with five more days
+    write_takeout(raw_folder / "takeout-2025-01-10.zip", 10, 2_000_000)
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 10
+
+def test_entries_keyed_by_archive_are_replaced(tmp_path, monkeypatch):
+    raw_folder, listens_folder = tmp_path / "raw", tmp_path / "listens"
+    raw_folder.mkdir()
+    old_archive = str(raw_folder / "takeout-2025-01-05.zip")
+    write_takeout(old_archive, 5, 1_000_000)
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 5
+
+    # a manifest written before files were keyed by name
+    manifest_path = listens_folder / "_youtube_manifest.json"
+    manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+    manifest[f"{old_archive}::{MEMBER_NAME}"] = manifest.pop("watch-history.json")
+    manifest_path.write_text(json.dumps(manifest), encoding='utf-8')
+
+    write_takeout(raw_folder / "takeout-2025-01-10.zip", 10, 2_000_000)
+    assert ingest(str(raw_folder), str(listens_folder), monkeypatch) == 10
+    assert list(load_manifest(str(manifest_path))) == ["watch-history.json"]
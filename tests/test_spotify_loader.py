@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import pyarrow as pa
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "extract"))
+
+from raw_sources import RawFile
+from spotify_loader import SPOTIFY_SCHEMA, records_to_table, iter_spotify_batches
+
+# the second record has fields the first one doesn't, including one spotify might add later
+RECORDS = [
+    {'ts': "2025-01-01T10:00:00Z", 'ms_played': 1000},
+    {
+        'ts': "2025-01-01T10:05:00Z", 'ms_played': 2000, 'skipped': True,
+        'master_metadata_track_name': "Song", 'new_field': "new",
+    },
+    {'ts': "2025-01-01T10:10:00Z", 'ms_played': 3000, 'skipped': False},
+]
+
+def write_history(folder, records):
+    path = os.path.join(folder, "Streaming_History_Audio_2025_0.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(records, file)
+    return RawFile(path)
+
+def test_fields_come_from_every_record():
+    table = records_to_table(RECORDS)
+
+    assert table['skipped'].to_pylist() == [None, True, False]
+    assert table['track_name'].to_pylist() == [None, "Song", None]
+    assert table['new_field'].to_pylist() == [None, "new", None]
+    assert table['duration_ms'].to_pylist() == [1000, 2000, 3000]
+
+def test_known_fields_come_first_and_unknown_ones_as_text():
+    table = records_to_table(RECORDS)
+
+    assert table.schema.names[:len(SPOTIFY_SCHEMA)] == SPOTIFY_SCHEMA.names
+    assert table.schema.field('new_field').type == pa.string()
+
+def test_streaming_batches_match_a_whole_file_read(tmp_path):
+    source = write_history(tmp_path, RECORDS)
+
+    # the new field only shows up in the second batch
+    batches = list(iter_spotify_batches(source, batch_size=1))
+
+    assert len(batches) == len(RECORDS)
+    assert all(batch.schema == batches[0].schema for batch in batches)
+    assert pa.concat_tables(batches).equals(records_to_table(RECORDS))
@@ -0,0 +1,54 @@
+import os
+import sys
+import pandas as pd
+
+# the scripts under src import each other by file name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src", "transform"))
+
+from merger import share_categories
+from track_matcher import resolve_keys
+
+def spotify_uri(number):
+    return f"spotify:track:{number:022d}"
+
+def listens(rows):
+    """a prepared history from (track, artist, spotify uri or None, plays) rows"""
+    tracks, artists, uris = [], [], []
+    for track, artist, uri, plays in rows:
+        tracks += [track] * plays
+        artists += [artist] * plays
+        uris += [uri] * plays
+    return pd.DataFrame({
+        'track': pd.Series(tracks, dtype='category'),
+        'artist': pd.Series(artists, dtype='category'),
+        'spotify_uri': pd.Series(uris, dtype='str').astype('category'),
+    })
+
+def resolved_artists(spotify_rows, youtube_rows):
+    dfs = [listens(spotify_rows), listens(youtube_rows)]
+    share_categories(dfs, ['track', 'artist', 'spotify_uri'])
+    resolve_keys(dfs)
+    return [sorted(set(df['artist'])) for df in dfs]
+
+def test_short_artist_names_need_to_be_nearly_identical():
+    spotify, youtube = resolved_artists(
+        [("mask off", "future", spotify_uri(1), 5), ("blinding lights", "the weeknd", spotify_uri(2), 5)],
+        [("mask off", "futures", None, 1), ("blinding lights", "the weekend", None, 1)],
+    )
+    assert spotify == ["future", "the weeknd"]
+    assert youtube == ["futures", "the weekend"]
+
+def test_youtube_spelling_joins_the_spotify_artist():
+    _, youtube = resolved_artists(
+        [("californication", "red hot chili peppers", spotify_uri(1), 5)],
+        [("californication", "red hot chilli peppers", None, 1)],
+    )
+    assert youtube == ["red hot chili peppers"]
+
+def test_artists_spotify_names_differently_stay_apart():
+    spotify, _ = resolved_artists(
+        [("by the way", "red hot chili peppers", spotify_uri(1), 5),
+         ("scar tissue", "red hot chilli peppers", spotify_uri(2), 1)],
+        [("yellow", "coldplay", None, 1)],
+    )
+    assert spotify == ["red hot chili peppers", "red hot chilli peppers"]